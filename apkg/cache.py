@@ -2,37 +2,545 @@
 apkg packaging file cache
 """
 
+import atexit
+import hashlib
 import json
+import os
 from pathlib import Path
+import sqlite3
+import stat
+import time
 
+from apkg import ex
+from apkg import cachestore
+from apkg.cachelock import InFlightLock
+from apkg.cachestore import (
+    LINK_PREFIX, TREE_PREFIX, ArtifactStore, file_checksum, is_file_checksum)
 from apkg.log import getLogger
-from apkg.util.common import hash_file
+from apkg.parse import parse_size
+from apkg import remotecache
+from apkg.util.common import atomic_write, file_lock
+from apkg.util import digest as _digest
+from apkg.util.digest import parallel_map
+import apkg.util.shutil35 as shutil
+from apkg.util.treehash import tree_hash
 
 
 log = getLogger(__name__)
 
 
-def file_checksum(path):
-    return hash_file(path).hexdigest()[:20]
+# environment variable overriding cache store path (shared store)
+STORE_ENV_VAR = 'APKG_CACHE_STORE'
+# seconds between recorded accesses of a cache entry so that
+# runs only reading cache don't need to write it
+ACCESS_RESOLUTION = 3600
+# caches with changes or stats waiting to be written by flush_all()
+_ACTIVE_CACHES = set()
+
+
+def file_fingerprint(path):
+    """
+    return cheap stat-based fingerprint of a file
+
+    fingerprint changes whenever file is replaced or modified
+    so it can be used to skip expensive checksum validation
+
+    symlinks aren't followed and directories are fingerprinted
+    by total size, latest mtime and number of their entries
+    """
+    st = os.lstat(str(path))
+    if stat.S_ISDIR(st.st_mode):
+        size, mtime, count = 0, st.st_mtime_ns, 0
+        for root, dirs, files in shutil.walk(str(path)):
+            for name in dirs + files:
+                est = os.lstat(os.path.join(root, name))
+                size += est.st_size
+                mtime = max(mtime, est.st_mtime_ns)
+                count += 1
+        return [size, mtime, count, st.st_dev]
+    return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev]
+
+
+def path_checksum(path, memo=True):
+    """
+    return checksum of a file, directory or symlink
+
+    directories are identified by tree digest of their contents
+    and symlinks by their target such as nix store path
+    """
+    path = Path(path)
+    if path.is_symlink():
+        target = os.readlink(str(path))
+        return LINK_PREFIX + hashlib.sha256(
+            target.encode('utf-8', 'surrogateescape')).hexdigest()[:20]
+    if path.is_dir():
+        return TREE_PREFIX + tree_hash(path)[:20]
+    return file_checksum(path, memo=memo)
+
+
+class JSONCacheBackend:
+    """
+    cache backend storing all entries in a single JSON file
+
+    whole file is parsed on first access and rewritten on commit
+    """
+    name = 'json'
+
+    # special top-level key with last access times: name -> key -> time
+    ACCESS_KEY = '.access'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.cache = None
+
+    def load(self):
+        self.cache = {}
+        if not self.path.exists():
+            log.verbose("cache not found: %s", self.path)
+            return
+        log.verbose("loading cache: %s", self.path)
+        try:
+            with self.path.open('r') as f:
+                self.cache = json.load(f)
+        except ValueError:
+            log.warning("ignoring corrupted cache: %s", self.path)
+
+    def _ensure_load(self):
+        if self.cache is None:
+            self.load()
+
+    def _apply(self, cache_name, key, entries):
+        if entries is None:
+            self.cache.get(cache_name, {}).pop(key, None)
+            self.cache.get(self.ACCESS_KEY, {}).get(
+                cache_name, {}).pop(key, None)
+        else:
+            self.cache.setdefault(cache_name, {})[key] = entries
+
+    def _apply_access(self, cache_name, key, atime):
+        if key not in self.cache.get(cache_name, {}):
+            return
+        self.cache.setdefault(self.ACCESS_KEY, {}).setdefault(
+            cache_name, {})[key] = atime
+
+    def get(self, cache_name, key):
+        self._ensure_load()
+        return self.cache.get(cache_name, {}).get(key)
+
+    def items(self):
+        """
+        iterate over all (cache_name, key, entries) in cache
+        """
+        self._ensure_load()
+        for cache_name, entries_map in self.cache.items():
+            if cache_name == self.ACCESS_KEY:
+                continue
+            for key, entries in entries_map.items():
+                yield cache_name, key, entries
+
+    def access_times(self):
+        """
+        return last access times as {(cache_name, key): time}
+        """
+        self._ensure_load()
+        return {(cache_name, key): atime
+                for cache_name, atimes in self.cache.get(
+                    self.ACCESS_KEY, {}).items()
+                for key, atime in atimes.items()}
+
+    def close(self):
+        self.cache = None
+
+    def access_time(self, cache_name, key):
+        """
+        return last access time of cache entry or None
+        """
+        self._ensure_load()
+        return self.cache.get(self.ACCESS_KEY, {}).get(
+            cache_name, {}).get(key)
+
+    def commit(self, changes, accessed=None):
+        """
+        atomically write changes and access times to disk
+
+        Changes are merged with current on-disk cache
+        under exclusive lock so that concurrent apkg processes
+        don't overwrite each other's entries.
+        """
+        log.verbose("saving cache: %s", self.path)
+        with file_lock(self.lock_path):
+            self.load()
+            for (cache_name, key), entries in changes.items():
+                self._apply(cache_name, key, entries)
+            for (cache_name, key), atime in (accessed or {}).items():
+                self._apply_access(cache_name, key, atime)
+            with atomic_write(self.path) as f:
+                json.dump(self.cache, f)
+
+
+class SQLiteCacheBackend:
+    """
+    cache backend storing entries in SQLite database
+
+    entries are looked up by indexed (cache_name, key) so cost of
+    cache access doesn't grow with number of entries
+
+    existing JSON cache is imported when database is created
+    """
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            cache_name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            entries TEXT NOT NULL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            accessed REAL,
+            PRIMARY KEY (cache_name, key)
+        )"""
+
+    def __init__(self, path, json_path=None):
+        self.path = Path(path)
+        self.json_path = json_path
+        self.conn = None
+
+    def load(self):
+        new_db = not self.path.exists()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        log.verbose("opening cache database: %s", self.path)
+        # NOTE(py35): explicit Path -> str conversion for python 3.5
+        # connection may be flushed from another thread on exit
+        self.conn = sqlite3.connect(
+            str(self.path), timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute(self.SCHEMA)
+            columns = [r[1] for r in self.conn.execute(
+                'PRAGMA table_info(entries)')]
+            if 'accessed' not in columns:
+                # database created before access tracking
+                self.conn.execute(
+                    'ALTER TABLE entries ADD COLUMN accessed REAL')
+        if new_db and self.json_path and self.json_path.exists():
+            self.migrate_json(self.json_path)
+
+    def _ensure_load(self):
+        if self.conn is None:
+            self.load()
+
+    def migrate_json(self, json_path):
+        """
+        import all entries from JSON cache
+        """
+        log.info("migrating JSON cache to SQLite: %s -> %s",
+                 json_path, self.path)
+        jbackend = JSONCacheBackend(json_path)
+        changes = {(cache_name, key): entries
+                   for cache_name, key, entries in jbackend.items()}
+        self.commit(changes, accessed=jbackend.access_times())
+
+    def get(self, cache_name, key):
+        self._ensure_load()
+        row = self.conn.execute(
+            'SELECT entries FROM entries WHERE cache_name = ? AND key = ?',
+            (cache_name, key)).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0])
+
+    def items(self):
+        """
+        iterate over all (cache_name, key, entries) in cache
+        """
+        self._ensure_load()
+        rows = self.conn.execute(
+            'SELECT cache_name, key, entries FROM entries')
+        for cache_name, key, entries in rows:
+            yield cache_name, key, json.loads(entries)
+
+    def access_times(self):
+        """
+        return last access times as {(cache_name, key): time}
+        """
+        self._ensure_load()
+        rows = self.conn.execute(
+            'SELECT cache_name, key, COALESCE(accessed, updated)'
+            ' FROM entries')
+        return {(cache_name, key): atime for cache_name, key, atime in rows}
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def access_time(self, cache_name, key):
+        """
+        return last access time of cache entry or None
+        """
+        self._ensure_load()
+        row = self.conn.execute(
+            'SELECT COALESCE(accessed, updated) FROM entries'
+            ' WHERE cache_name = ? AND key = ?',
+            (cache_name, key)).fetchone()
+        return row[0] if row else None
+
+    def commit(self, changes, accessed=None):
+        """
+        write changes and access times to database in a single transaction
+        """
+        self._ensure_load()
+        log.verbose("saving cache: %s", self.path)
+        now = time.time()
+        with self.conn:
+            for (cache_name, key), entries in changes.items():
+                if entries is None:
+                    self.conn.execute(
+                        'DELETE FROM entries'
+                        ' WHERE cache_name = ? AND key = ?',
+                        (cache_name, key))
+                    continue
+                # preserve creation time of existing entries
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, '
+                    'COALESCE((SELECT created FROM entries'
+                    ' WHERE cache_name = ? AND key = ?), ?), ?, ?)',
+                    (cache_name, key, json.dumps(entries),
+                     cache_name, key, now, now, now))
+            for (cache_name, key), atime in (accessed or {}).items():
+                self.conn.execute(
+                    'UPDATE entries SET accessed = ?'
+                    ' WHERE cache_name = ? AND key = ?',
+                    (atime, cache_name, key))
+
+
+class CacheStats:
+    """
+    cache usage statistics recorded per cache name
+
+    counters of each apkg run are appended to stats file on exit
+    so that cache effectiveness can be followed over time
+    """
+    COUNTERS = [
+        'hits',             # valid cache entry found
+        'remote_hits',      # cache entry pulled from remote cache
+        'shared_hits',      # cache entry created by concurrent apkg process
+        'wait_time',        # seconds spent waiting for concurrent apkg
+        'misses',           # cache entry not found or invalid
+        'invalid',          # cache entry with missing/modified file
+        'bytes_verified',   # bytes hashed to validate cache entries
+        'validation_time',  # seconds spent validating cache entries
+        'builds',           # cache entries created after a miss
+        'build_time',       # seconds between miss and cache update
+    ]
+    # only keep stats of this many last runs
+    MAX_RUNS = 1000
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.counters = {}
+
+    def add(self, cache_name, counter, value=1):
+        c = self.counters.setdefault(cache_name, {})
+        c[counter] = c.get(counter, 0) + value
+
+    def load_runs(self):
+        """
+        return list of recorded runs: {'time': TIME, 'stats': COUNTERS}
+        """
+        if not self.path.exists():
+            return []
+        try:
+            with self.path.open('r') as f:
+                return json.load(f).get('runs', [])
+        except ValueError:
+            log.warning("ignoring corrupted cache stats: %s", self.path)
+            return []
+
+    def save(self):
+        """
+        append counters of current run to stats file
+        """
+        if not self.counters:
+            return
+        with file_lock(self.lock_path):
+            runs = self.load_runs()
+            runs.append({'time': time.time(), 'stats': self.counters})
+            with atomic_write(self.path) as f:
+                json.dump({'runs': runs[-self.MAX_RUNS:]}, f)
+        self.counters = {}
+
+
+def sum_stats(runs):
+    """
+    sum per cache name counters of multiple runs
+    """
+    total = {}
+    for run in runs:
+        for cache_name, counters in run['stats'].items():
+            t = total.setdefault(cache_name, {})
+            for counter, value in counters.items():
+                t[counter] = t.get(counter, 0) + value
+    return total
+
+
+CACHE_BACKENDS = {
+    JSONCacheBackend.name: JSONCacheBackend,
+    SQLiteCacheBackend.name: SQLiteCacheBackend,
+}
+DEFAULT_CACHE_BACKEND = JSONCacheBackend.name
 
 
 class ProjectCache:
     def __init__(self, project):
         self.project = project
-        self.loaded = False
-        self.cache = {}
+        self.backend = None
+        self._store = None
+        self._remote = None
         self.checksum = None
+        self.paranoid = False
+        self.dirty = False
+        # pending changes: (cache_name, key) -> entries or None on delete
+        self.changes = {}
+        # pending access times: (cache_name, key) -> time
+        self.accessed = {}
+        # usage statistics
+        self.stats = CacheStats(project.cache_stats_path)
+        # cache miss times: (cache_name, key) -> time
+        self.miss_times = {}
+        # held in-flight locks: (cache_name, key) -> InFlightLock
+        self.in_flight = {}
+        # file digests persisted in pkg/.digests.json
+        self.digests_loaded = False
+
+    def new_backend(self):
+        """
+        create cache backend selected by cache.backend config option
+        """
+        name = self.project.config_get('cache.backend')
+        name = name or DEFAULT_CACHE_BACKEND
+        if name not in CACHE_BACKENDS:
+            raise ex.InvalidChoice(
+                var='cache.backend',
+                opts=", ".join(CACHE_BACKENDS),
+                val=name)
+        if name == SQLiteCacheBackend.name:
+            return SQLiteCacheBackend(
+                self.project.cache_db_path,
+                json_path=self.project.cache_path)
+        return JSONCacheBackend(self.project.cache_path)
+
+    @property
+    def store(self):
+        """
+        content-addressable store used for cached files
+
+        None when disabled by cache.store config option or when it isn't
+        set and files can't be reflinked into store as copying all cached
+        files would double disk usage,
+        APKG_CACHE_STORE environment variable sets shared store path
+        """
+        if self._store is None:
+            enabled = self.project.config_get('cache.store')
+            path = os.environ.get(STORE_ENV_VAR) or self.project.store_path
+            store = ArtifactStore(path)
+            if enabled is None and not store.can_reflink(
+                    self.project.output_path):
+                log.verbose("cache store disabled, reflinks aren't"
+                            " supported: %s", path)
+                enabled = False
+            self._store = store if enabled is not False else False
+        return self._store or None
+
+    @property
+    def remote(self):
+        """
+        remote cache tier (apkg.remotecache.RemoteCache)
+
+        None unless configured using cache.remote config option
+        or APKG_CACHE_REMOTE environment variable
+        """
+        if self._remote is None:
+            self._remote = remotecache.get_remote_cache(
+                self.project, store=self.store) or False
+        return self._remote or None
 
     def save(self):
-        json.dump(self.cache, self.project.cache_path.open('w'))
+        """
+        write pending changes using cache backend
+
+        use flush() in order to only save when needed
+        """
+        self._ensure_load()
+        self.backend.commit(self.changes, accessed=self.accessed)
+        self.changes = {}
+        self.accessed = {}
+        self.dirty = False
+
+    def flush(self):
+        """
+        save pending cache changes if there are any
+
+        cache changes are collected in memory and flushed once on apkg
+        command exit (see flush_all()) but it's possible to flush
+        explicitly at any time to create a checkpoint
+        """
+        if self.dirty:
+            self.save()
+
+    def _set(self, cache_name, key, entries):
+        """
+        record cache entry change to be written by save()
+
+        use entries=None to delete the entry
+        """
+        self.changes[(cache_name, key)] = entries
+        if entries is None:
+            self.accessed.pop((cache_name, key), None)
+            self._mark_dirty()
+        else:
+            self._touch(cache_name, key)
+
+    def _touch(self, cache_name, key):
+        """
+        record cache entry access for LRU eviction
+
+        access of unchanged entry is only recorded when its last access
+        is older than ACCESS_RESOLUTION
+        """
+        now = time.time()
+        if (cache_name, key) not in self.changes:
+            self._ensure_load()
+            atime = self.backend.access_time(cache_name, key)
+            if atime and now - atime < ACCESS_RESOLUTION:
+                return
+        self.accessed[(cache_name, key)] = now
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        self.dirty = True
+        _ACTIVE_CACHES.add(self)
+
+    def _count(self, cache_name, counter, value=1):
+        self.stats.add(cache_name, counter, value)
+        _ACTIVE_CACHES.add(self)
+
+    def _get(self, cache_name, key):
+        """
+        get raw cache entries including pending changes
+        """
+        try:
+            return self.changes[(cache_name, key)]
+        except KeyError:
+            return self.backend.get(cache_name, key)
 
     def load(self):
-        cache_path = self.project.cache_path
-        if not cache_path.exists():
-            log.verbose("cache not found: %s", cache_path)
-            return
-        log.verbose("loading cache: %s", cache_path)
-        self.cache = json.load(self.project.cache_path.open('r'))
+        if not self.backend:
+            self.backend = self.new_backend()
+        self.backend.load()
 
     def _ensure_load(self):
         """
@@ -40,24 +548,55 @@ class ProjectCache:
 
         you don't need to call this directly
         """
-        if self.loaded:
+        if self.backend:
             return
         self.load()
-        self.loaded = True
 
-    def update(self, cache_name, key, paths):
+    def update(self, cache_name, key, paths, push=True):
         """
         update cache entry
+
+        entry is also pushed to remote cache if configured
+        unless push=False
         """
         log.verbose("cache update for %s: %s -> %s",
                     cache_name, key, paths[0])
         assert key
         self._ensure_load()
-        if cache_name not in self.cache:
-            self.cache[cache_name] = {}
-        entries = list(map(path2entry, paths))
-        self.cache[cache_name][key] = entries
-        self.save()
+        entries = paths2entries(paths, store=self.store)
+        self._update_entries(cache_name, key, entries, push=push)
+
+    def update_from(self, cache_name, key, src_cache_name, src_key):
+        """
+        update cache entry to point to the same files as another entry
+
+        files aren't hashed again
+
+        return True on success or False if source entry doesn't exist
+        """
+        log.verbose("cache update for %s: %s -> %s: %s",
+                    cache_name, key, src_cache_name, src_key)
+        assert key
+        self._ensure_load()
+        entries = self._get(src_cache_name, src_key)
+        if not entries:
+            return False
+        self._update_entries(cache_name, key, entries)
+        return True
+
+    def _update_entries(self, cache_name, key, entries, push=True):
+        self._set(cache_name, key, entries)
+        miss_time = self.miss_times.pop((cache_name, key), None)
+        if miss_time:
+            # time it took to create files missing from cache
+            self._count(cache_name, 'builds')
+            self._count(cache_name, 'build_time', time.time() - miss_time)
+        if push and self.remote:
+            self.remote.push(cache_name, key, entries)
+        if (cache_name, key) in self.in_flight:
+            # make the new entry visible to waiting apkg processes
+            self.flush()
+            self.in_flight.pop((cache_name, key)).release()
 
     def get(self, cache_name, key):
         """
@@ -65,66 +604,302 @@ class ProjectCache:
         """
         log.verbose("cache query for %s: %s",
                     cache_name, key)
+        assert key
+        self._ensure_load()
+        entries = self._get(cache_name, key)
+        if not entries:
+            return self._miss(cache_name, key)
+        start = time.time()
+        paths = self.validate(cache_name, key, entries)
+        self._count(cache_name, 'validation_time', time.time() - start)
+        if paths is None:
+            # invalid entry
+            self._count(cache_name, 'invalid')
+            return self._miss(cache_name, key)
+        self._count(cache_name, 'hits')
+        return paths
+
+    def validate(self, cache_name, key, entries):
+        """
+        validate cache entries and return their paths
 
-        def validate(path, checksum):
-            if not path.exists():
+        invalid cache entry is deleted and None is returned
+        """
+        paths = []
+        # files to hash: (path, checksum, fingerprint, real_fingerprint)
+        unverified = []
+        for e in entries:
+            path = entry2path(e)
+            _, checksum, *rest = e
+            fingerprint = rest[0] if rest else None
+            if not path.exists() and not (
+                    self.store and self.store.restore(path, checksum)):
                 log.info("removing missing file from cache: %s", path)
                 self.delete(cache_name, key)
-                return False
-            real_checksum = file_checksum(path)
+                return None
+            real_fingerprint = file_fingerprint(path)
+            if self.paranoid or fingerprint != real_fingerprint:
+                unverified.append(
+                    (path, checksum, fingerprint, real_fingerprint))
+            # else file wasn't touched since it was cached - skip hashing
+            paths.append(path)
+
+        # hash files in parallel
+        real_checksums = parallel_map(
+            lambda u: path_checksum(u[0], memo=not self.paranoid),
+            unverified)
+        refreshed = {}
+        for (path, checksum, fingerprint, real_fingerprint), real_checksum \
+                in zip(unverified, real_checksums):
+            self._count(cache_name, 'bytes_verified', real_fingerprint[0])
             if real_checksum != checksum:
                 log.info("removing invalid cache entry: %s", path)
                 self.delete(cache_name, key)
-                return False
-            return True
+                return None
+            if fingerprint != real_fingerprint:
+                refreshed[str(path)] = real_fingerprint
 
-        def entry2path_valid(e):
-            return entry2path(e, validate_fun=validate)
+        if refreshed:
+            # content is valid but stat changed (touch, copy, ...)
+            log.verbose("refreshing cache entry fingerprints for %s: %s",
+                        cache_name, key)
+            # legacy entries without fingerprint are always refreshed
+            self._set(cache_name, key, [
+                [e[0], e[1], refreshed.get(e[0]) or e[2]]
+                for e in entries])
+        else:
+            self._touch(cache_name, key)
+        return paths
 
-        assert key
+    def items(self):
+        """
+        iterate over all (cache_name, key, entries) in cache
+        including pending changes
+        """
         self._ensure_load()
-        entries = self.cache.get(cache_name, {}).get(key)
-        if not entries:
+        for cache_name, key, entries in self.backend.items():
+            if (cache_name, key) not in self.changes:
+                yield cache_name, key, entries
+        for (cache_name, key), entries in list(self.changes.items()):
+            if entries is not None:
+                yield cache_name, key, entries
+
+    def access_times(self):
+        """
+        return dict of (cache_name, key) -> last access time
+        """
+        self._ensure_load()
+        return self.backend.access_times()
+
+    def _miss(self, cache_name, key):
+        """
+        handle local cache miss
+
+        try remote cache and remember miss time to measure build time
+        """
+        paths = self.get_remote(cache_name, key)
+        if paths:
+            self._count(cache_name, 'remote_hits')
+            return paths
+        paths = self.wait_in_flight(cache_name, key)
+        if paths:
+            self._count(cache_name, 'shared_hits')
+            return paths
+        self._count(cache_name, 'misses')
+        self.miss_times[(cache_name, key)] = time.time()
+        return None
+
+    def wait_in_flight(self, cache_name, key):
+        """
+        deduplicate creation of the same cache entry by multiple processes
+
+        Acquire in-flight lock of the cache entry which is held until
+        the entry is created using update() or apkg exits. When another
+        apkg process holds the lock, wait for it to finish and reuse its
+        result or take over when it dies without creating the entry.
+
+        Single-flight can be disabled by cache.single_flight = false.
+
+        return paths created by another process or None
+        """
+        if self.project.config_get('cache.single_flight') is False:
             return None
-        paths = list(map(entry2path_valid, entries))
-        if None in paths:
-            # invalid entry
+        if (cache_name, key) in self.in_flight:
+            return None
+        h = hashlib.sha256(('%s\0%s' % (cache_name, key)).encode('utf-8'))
+        lock = InFlightLock(
+            self.project.in_flight_path / ('%s.lock' % h.hexdigest()[:32]))
+        _ACTIVE_CACHES.add(self)
+        if lock.try_acquire():
+            self.in_flight[(cache_name, key)] = lock
             return None
+        if lock.is_held_by_caller() and not lock.is_stale():
+            log.verbose("%s is already being created by this apkg process",
+                        cache_name)
+            return None
+        owner = lock.owner() or {}
+        log.info("waiting for %s being created by another apkg process"
+                 " (PID %s on %s)", cache_name,
+                 owner.get('pid', '?'), owner.get('host', '?'))
+        start = time.time()
+        timeout = self.project.config_get('cache.lock_timeout')
+        acquired = lock.wait(timeout=timeout)
+        self._count(cache_name, 'wait_time', time.time() - start)
+        if acquired:
+            self.in_flight[(cache_name, key)] = lock
+        else:
+            log.warning("timed out waiting for %s, creating it anyway",
+                        cache_name)
+        # load entry created by the other process
+        backend = self.new_backend()
+        try:
+            entries = backend.get(cache_name, key)
+        finally:
+            backend.close()
+        paths = None
+        if entries:
+            paths = self.validate(cache_name, key, entries)
+        if paths:
+            log.verbose("reusing %s created by another apkg process",
+                        cache_name)
+            if acquired:
+                self.in_flight.pop((cache_name, key)).release()
+            self._touch(cache_name, key)
+        return paths
+
+    def load_digests(self):
+        """
+        load file digests persisted by previous runs
+
+        enabled by cache.persist_digests config option
+        """
+        if self.digests_loaded:
+            return
+        self.digests_loaded = True
+        if not self.project.config_get('cache.persist_digests'):
+            return
+        _digest.REGISTRY.load(self.project.digests_path)
+        _ACTIVE_CACHES.add(self)
+
+    def save_digests(self):
+        if self.digests_loaded and self.project.config_get(
+                'cache.persist_digests'):
+            _digest.REGISTRY.save(self.project.digests_path)
+
+    def release_in_flight(self):
+        """
+        release all held in-flight locks
+        """
+        for lock in self.in_flight.values():
+            lock.release()
+        self.in_flight = {}
+
+    def get_remote(self, cache_name, key):
+        """
+        get cache entry from remote cache and add it to local cache
+
+        return paths or None if remote cache isn't available
+        """
+        if not self.remote:
+            return None
+        paths = self.remote.pull(cache_name, key)
+        if paths:
+            self.update(cache_name, key, paths, push=False)
         return paths
 
     def delete(self, cache_name, key):
         """
         delete cache entry
         """
-        self.cache[cache_name].pop(key, None)
-        self.save()
+        self._set(cache_name, key, None)
+
+    def auto_gc(self):
+        """
+        run cachestore.gc() with configured limits if cache.auto_gc is enabled
+        """
+        if not self.project.config_get('cache.auto_gc'):
+            return None
+        max_size = self.project.config_get('cache.max_size')
+        max_age = self.project.config_get('cache.max_age')
+        if max_size is None and max_age is None:
+            log.warning("cache.auto_gc requires cache.max_size"
+                        " and/or cache.max_age to be set")
+            return None
+        log.verbose("running automatic cache GC")
+        return cachestore.gc(
+            self, max_size=parse_size(max_size), max_age=max_age)
 
-    def enabled(self, use_cache=True):
+    def enabled(self, use_cache=True, paranoid=False):
         """
         helper to tell and log if caching is enabled and supported
 
         optional use_cache argument provided for shared
         argument parsing and logging from apkg.commands
+
+        paranoid=True turns on full checksum validation of cached files
+        for the rest of the project's lifetime instead of relying on
+        file fingerprints (size, mtime, inode, device)
         """
+        if paranoid and not self.paranoid:
+            log.verbose("paranoid cache mode -> full checksum validation")
+            self.paranoid = True
         if use_cache:
+            self.load_digests()
             vcs = self.project.vcs
             if vcs:
                 log.verbose("%s VCS detected -> cache ENABLED", vcs)
-                return True
             else:
-                log.verbose("VCS not detected -> cache DISABLED")
+                log.verbose("VCS not detected -> cache ENABLED "
+                            "using project tree content hash")
+            return True
         else:
             log.verbose("cache DISABLED")
         return False
 
 
-def path2entry(path):
+def flush_all():
+    """
+    flush pending changes of all project caches
+
+    this is called on apkg command exit as well as on python exit
+    """
+    for cache in list(_ACTIVE_CACHES):
+        cache.flush()
+        cache.release_in_flight()
+        cache.save_digests()
+        cache.auto_gc()
+        cache.stats.save()
+    _ACTIVE_CACHES.clear()
+
+
+atexit.register(flush_all)
+
+
+def path2entry(path, store=None):
     """
     convert a path to corresponding cache entry
 
-    return (fn, checksum) or a list of that on multiple paths
+    if store is specified, regular file is added into it
+    and checksum serves as a reference to store object
+
+    return (fn, checksum, fingerprint)
     """
-    return str(path), file_checksum(path)
+    return paths2entries([path], store=store)[0]
+
+
+def paths2entries(paths, store=None):
+    """
+    convert multiple paths to cache entries
+
+    files are hashed in parallel, see path2entry()
+    """
+    checksums = parallel_map(path_checksum, paths)
+    entries = []
+    for path, checksum in zip(paths, checksums):
+        if store and is_file_checksum(checksum):
+            store.add(path, checksum)
+        entries.append((str(path), checksum, file_fingerprint(path)))
+    return entries
 
 
 def entry2path(entry, validate_fun=None):
@@ -133,10 +908,14 @@ def entry2path(entry, validate_fun=None):
 
     if validate_fun is specified, it's used confirm file has
     valid checksum and flush invalid cache entry if it doesn't
+
+    entries created by older apkg versions lack fingerprint
+    and are always validated using full checksum
     """
-    fn, checksum = entry
+    fn, checksum, *rest = entry
+    fingerprint = rest[0] if rest else None
     p = Path(fn)
     if validate_fun:
-        if not validate_fun(p, checksum):
+        if not validate_fun(p, checksum, fingerprint):
             return None
     return p
@@ -0,0 +1,212 @@
+"""
+apkg cache bundles for transferring cache entries between machines
+"""
+import fnmatch
+import io
+import json
+import os
+from pathlib import Path
+import re
+import tarfile
+import tempfile
+import time
+
+from apkg import ex
+from apkg.cachestore import file_checksum, is_file_checksum
+from apkg.log import getLogger
+from apkg.parse import split_archive_ext
+from apkg.util.common import clone_file
+import apkg.util.shutil35 as shutil
+
+
+log = getLogger(__name__)
+
+
+# name of manifest file in cache bundles
+BUNDLE_MANIFEST = 'manifest.json'
+# checksum of a regular file, also used as file name in bundle
+RE_FILE_CHECKSUM = re.compile(r'^[0-9a-f]+$')
+
+
+def tar_mode(path, mode):
+    """
+    return tarfile mode with compression selected by file extension
+    """
+    _, ext = split_archive_ext(Path(path).name)
+    for comp in ['gz', 'bz2', 'xz']:
+        if ext.endswith('.' + comp):
+            return '%s:%s' % (mode, comp)
+    return mode
+
+
+def export_bundle(cache, bundle_path, cache_names=None):
+    """
+    export valid cache entries and their files into a bundle archive
+
+    Args:
+        cache: apkg.cache.ProjectCache to export
+        bundle_path: path to tar archive to create, compression
+                     is selected by extension (.tar.gz, .tar.xz, ...)
+        cache_names: only export cache names matching these
+                     shell-style patterns such as 'archive/*'
+
+    Files are stored relative to project dir so that bundle can be
+    imported into project checked out in a different location.
+
+    return list of exported (cache_name, key)
+    """
+    proj_path = cache.project.path.resolve()
+    selected = [(cache_name, key, entries)
+                for cache_name, key, entries in list(cache.items())
+                if not cache_names or any(
+                    fnmatch.fnmatch(cache_name, p) for p in cache_names)]
+    manifest = {
+        'project': cache.project.name,
+        'entries': [],
+    }
+    exported = []
+    added = set()
+    log.verbose("exporting %d cache entries to bundle: %s",
+                len(selected), bundle_path)
+    with tarfile.open(str(bundle_path), tar_mode(bundle_path, 'w')) as tar:
+        for cache_name, key, entries in selected:
+            paths = cache.validate(cache_name, key, entries)
+            if not paths:
+                continue
+            files = []
+            for path, (_, checksum, *_) in zip(paths, entries):
+                if not is_file_checksum(checksum):
+                    log.verbose("not exporting %s entry with dir or"
+                                " symlink: %s", cache_name, path)
+                    break
+                try:
+                    rel_path = path.resolve().relative_to(proj_path)
+                except ValueError:
+                    log.warning("not exporting %s entry with file outside"
+                                " of project: %s", cache_name, path)
+                    break
+                files.append([str(rel_path), checksum])
+            else:
+                for path, (_, checksum) in zip(paths, files):
+                    if checksum not in added:
+                        log.verbose("adding file to bundle: %s", path)
+                        tar.add(str(path), arcname='objects/%s' % checksum)
+                        added.add(checksum)
+                manifest['entries'].append({
+                    'cache_name': cache_name,
+                    'key': key,
+                    'files': files,
+                })
+                exported.append((cache_name, key))
+        data = json.dumps(manifest).encode('utf-8')
+        info = tarfile.TarInfo(BUNDLE_MANIFEST)
+        info.size = len(data)
+        info.mtime = time.time()
+        tar.addfile(info, io.BytesIO(data))
+    return exported
+
+
+def import_bundle(cache, bundle_path):
+    """
+    import cache entries and their files from a bundle archive
+
+    Files are extracted into current project dir unless
+    identical files are already present.
+
+    Whole bundle is validated and its files are extracted into
+    a staging dir first so that invalid bundle doesn't modify project.
+
+    return list of imported (cache_name, key)
+    """
+    log.verbose("importing cache bundle: %s", bundle_path)
+    cache.project.output_path.mkdir(parents=True, exist_ok=True)
+    staging = tempfile.mkdtemp(
+        prefix='.bundle-import-', dir=str(cache.project.output_path))
+    try:
+        with tarfile.open(str(bundle_path), 'r:*') as tar:
+            entries = _read_bundle(tar, bundle_path, cache.project)
+            staged = _stage_bundle_files(tar, entries, staging)
+        imported = []
+        for cache_name, key, files in entries:
+            paths = []
+            for path, checksum in files:
+                if checksum in staged:
+                    log.verbose("extracting file from bundle: %s", path)
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    clone_file(staged[checksum], path)
+                paths.append(path)
+            cache.update(cache_name, key, paths, push=False)
+            imported.append((cache_name, key))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return imported
+
+
+def _read_bundle(tar, bundle_path, project):
+    """
+    return validated bundle entries: [(cache_name, key, files)]
+
+    files are [(path, checksum)]
+    """
+    proj_path = project.path.resolve()
+    try:
+        manifest = json.load(io.TextIOWrapper(
+            tar.extractfile(BUNDLE_MANIFEST), encoding='utf-8'))
+    except KeyError:
+        raise ex.InvalidFormat(
+            fmt="cache bundle without manifest: %s" % bundle_path)
+    bproj = manifest.get('project')
+    if bproj != project.name:
+        log.warning("importing cache bundle of different project: %s",
+                    bproj)
+    entries = []
+    try:
+        for e in manifest['entries']:
+            files = []
+            for rel_fn, checksum in e['files']:
+                if not RE_FILE_CHECKSUM.match(checksum):
+                    raise ex.InvalidFormat(
+                        fmt="invalid cache bundle file checksum: %s"
+                        % checksum)
+                path = project.path / rel_fn
+                try:
+                    path.resolve().relative_to(proj_path)
+                except ValueError:
+                    raise ex.InvalidFormat(
+                        fmt="cache bundle file outside of project: %s"
+                        % rel_fn)
+                files.append((path, checksum))
+            entries.append((e['cache_name'], e['key'], files))
+    except (KeyError, TypeError, ValueError):
+        raise ex.InvalidFormat(
+            fmt="invalid cache bundle manifest: %s" % bundle_path)
+    return entries
+
+
+def _stage_bundle_files(tar, entries, staging):
+    """
+    extract and verify bundle files missing from project
+
+    return dict of checksum -> staged file path
+    """
+    staged = {}
+    for _, _, files in entries:
+        for path, checksum in files:
+            if checksum in staged or (
+                    path.exists() and file_checksum(path) == checksum):
+                continue
+            try:
+                obj = tar.extractfile('objects/%s' % checksum)
+            except KeyError:
+                obj = None
+            if obj is None:
+                raise ex.InvalidFormat(
+                    fmt="cache bundle file missing: %s" % path)
+            staged_path = os.path.join(staging, checksum)
+            with open(staged_path, 'wb') as f:
+                shutil.copyfileobj(obj, f)
+            if file_checksum(staged_path, memo=False) != checksum:
+                raise ex.InvalidFormat(
+                    fmt="cache bundle file checksum mismatch: %s" % path)
+            staged[checksum] = staged_path
+    return staged
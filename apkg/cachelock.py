@@ -0,0 +1,155 @@
+"""
+apkg cross-process locks of cache entries being created
+"""
+import errno
+import fcntl
+import json
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+
+from apkg.log import getLogger
+
+
+log = getLogger(__name__)
+
+
+# in-flight locks held by this process: lock path -> owner thread ident
+_HELD_LOCKS = {}
+
+
+class InFlightLock:
+    """
+    cross-process lock marking cache entry which is being created
+
+    Owner holds exclusive flock on lock file which is released by kernel
+    when owner dies. Owner PID and host are stored in the lock file and
+    its mtime is periodically updated (heartbeat) so that waiters are
+    also able to detect dead owner on filesystems where flock isn't
+    shared between hosts.
+    """
+    # seconds between heartbeats
+    HEARTBEAT = 10
+    # owner without heartbeat for this many seconds is considered dead
+    STALE = 60
+    # seconds between lock attempts of waiters
+    POLL = 0.5
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.fd = None
+        self._stop = None
+
+    def owner(self):
+        """
+        return lock owner info dict or None
+        """
+        try:
+            return json.loads(self.path.open().read())
+        except (OSError, ValueError):
+            return None
+
+    def try_acquire(self):
+        """
+        try to acquire the lock without waiting
+
+        return True on success
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # previous owner might have removed the file in the meantime
+            if os.fstat(fd).st_ino != os.stat(str(self.path)).st_ino:
+                raise FileNotFoundError(errno.ENOENT, "lock file replaced")
+        except OSError:
+            os.close(fd)
+            return False
+        owner = {
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'started': time.time(),
+        }
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps(owner).encode('utf-8'))
+        self.fd = fd
+        _HELD_LOCKS[os.path.realpath(str(self.path))] = threading.get_ident()
+        self._stop = threading.Event()
+        thread = threading.Thread(target=self._heartbeat, args=(self._stop,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def is_held_by_caller(self):
+        """
+        tell if lock is held by current thread of this process
+
+        (such as through another cache object of the same project)
+        waiting for it would never end
+        """
+        owner = _HELD_LOCKS.get(os.path.realpath(str(self.path)))
+        return owner == threading.get_ident()
+
+    def _heartbeat(self, stop):
+        while not stop.wait(self.HEARTBEAT):
+            try:
+                os.utime(str(self.path))
+            except OSError:
+                return
+
+    def is_stale(self):
+        """
+        tell if current lock owner is dead
+        """
+        try:
+            age = time.time() - self.path.stat().st_mtime
+        except OSError:
+            return False
+        if age > self.STALE:
+            return True
+        owner = self.owner()
+        if owner and owner.get('host') == socket.gethostname():
+            try:
+                os.kill(owner['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except (OSError, KeyError, TypeError):
+                pass
+        return False
+
+    def wait(self, timeout=None):
+        """
+        wait until lock is acquired
+
+        lock of a dead owner is taken over
+
+        return True when acquired or False on timeout
+        """
+        start = time.time()
+        while not self.try_acquire():
+            if self.is_stale():
+                log.warning("taking over lock of dead apkg process: %s",
+                            self.path)
+                try:
+                    self.path.unlink()
+                except OSError:
+                    pass
+                continue
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(self.POLL)
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        self._stop.set()
+        _HELD_LOCKS.pop(os.path.realpath(str(self.path)), None)
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+        os.close(self.fd)
+        self.fd = None
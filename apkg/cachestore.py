@@ -0,0 +1,233 @@
+"""
+apkg cache store of artifacts and cache garbage collection
+"""
+import collections
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from apkg.log import getLogger
+from apkg.util.common import clone_file, reflink_file
+from apkg.util.digest import file_digest
+import apkg.util.shutil35 as shutil
+
+
+log = getLogger(__name__)
+
+
+# checksum prefixes of cached symlinks and directories
+LINK_PREFIX = 'link:'
+TREE_PREFIX = 'tree:'
+
+
+def file_checksum(path, memo=True):
+    """
+    return checksum of file contents
+
+    file digests are memoized for the process by apkg.util.digest
+    unless memo=False
+    """
+    return file_digest(path, memo=memo)[:20]
+
+
+def is_file_checksum(checksum):
+    """
+    tell if checksum belongs to a regular file (not a dir or symlink)
+    """
+    return not checksum.startswith((LINK_PREFIX, TREE_PREFIX))
+
+
+class ArtifactStore:
+    """
+    content-addressable store of cached files
+
+    Store objects are named by their content checksum so identical
+    artifacts are only stored once and cached files can be restored
+    from store cheaply.
+
+    Cached files are reflinked (or copied) into and out of store,
+    never hardlinked, because tools might overwrite their outputs
+    in place which would corrupt store objects.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def object_path(self, checksum):
+        return self.path / checksum[:2] / checksum[2:]
+
+    def add(self, path, checksum):
+        """
+        add file into store unless identical store object exists
+        """
+        obj = self.object_path(checksum)
+        if obj.exists():
+            if os.path.samefile(str(obj), str(path)):
+                # detach file hardlinked to store by older apkg
+                method = clone_file(obj, path)
+                log.verbose("%s from cache store: %s", method, path)
+                return obj
+            # digest of store object is usually memoized
+            if (obj.stat().st_size == path.stat().st_size
+                    and file_checksum(obj) == checksum):
+                return obj
+            log.warning("replacing corrupted cache store object: %s", obj)
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        method = clone_file(path, obj)
+        log.verbose("%s into cache store: %s", method, path)
+        return obj
+
+    def can_reflink(self, src_dir):
+        """
+        tell if files from src_dir can be reflinked into store
+        """
+        store_dir = self.path.parent
+        try:
+            store_dir.mkdir(parents=True, exist_ok=True)
+            src_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                    dir=str(src_dir), prefix='.reflink-probe-') as src:
+                src.write(b'apkg')
+                src.flush()
+                dst = store_dir / ('.reflink-probe-%d' % os.getpid())
+                reflink_file(src.name, dst)
+                dst.unlink()
+        except OSError:
+            return False
+        return True
+
+    def checksums(self):
+        """
+        iterate over checksums of all store objects
+        """
+        for obj in self.path.glob('*/*'):
+            yield obj.parent.name + obj.name
+
+    def restore(self, path, checksum):
+        """
+        restore missing file from store if possible
+
+        return True on success
+        """
+        if not is_file_checksum(checksum):
+            return False
+        obj = self.object_path(checksum)
+        if not obj.exists():
+            return False
+        if file_checksum(obj, memo=False) != checksum:
+            log.warning("removing corrupted cache store object: %s", obj)
+            obj.unlink()
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        method = clone_file(obj, path)
+        log.info("restored file from cache store (%s): %s", method, path)
+        return True
+
+
+def gc(cache, max_size=None, max_age=None, dry_run=False):
+    """
+    evict least recently used cache entries and delete their files
+
+    Args:
+        cache: apkg.cache.ProjectCache to collect
+        max_size: evict entries until cached files take at most
+                  max_size bytes
+        max_age: evict entries not accessed for more than max_age days
+        dry_run: only return entries to evict
+
+    Only files inside project output dir (pkg/) are deleted.
+
+    return list of evicted (cache_name, key)
+    """
+    cache.flush()
+    atimes = cache.access_times()
+    records = sorted(
+        (atimes.get((cache_name, key), 0), cache_name, key, entries)
+        for cache_name, key, entries in cache.items())
+
+    # count references to file contents to tell actual disk usage
+    refs = collections.Counter()
+    sizes = {}
+    for _, _, _, entries in records:
+        for fn, checksum, *rest in entries:
+            refs[checksum] += 1
+            sizes[checksum] = entry_size(fn, *rest)
+    total = sum(sizes.values())
+    log.verbose("cache size: %d bytes in %d entries",
+                total, len(records))
+
+    now = time.time()
+    evicted = []
+    for atime, cache_name, key, entries in records:
+        # records are sorted from least recently used
+        expired = max_age is not None and now - atime > max_age * 86400
+        oversized = max_size is not None and total > max_size
+        if not (expired or oversized):
+            break
+        evicted.append((cache_name, key, entries))
+        for _, checksum, *_ in entries:
+            refs[checksum] -= 1
+            if refs[checksum] <= 0:
+                total -= sizes[checksum]
+
+    if dry_run:
+        return [(cache_name, key) for cache_name, key, _ in evicted]
+
+    kept_paths = set()
+    for _, cache_name, key, entries in records[len(evicted):]:
+        kept_paths.update(e[0] for e in entries)
+    out_path = cache.project.output_path.resolve()
+    for cache_name, key, entries in evicted:
+        log.info("evicting cache entry %s: %s", cache_name, key)
+        cache.delete(cache_name, key)
+        for fn, *_ in entries:
+            if fn not in kept_paths:
+                remove_output_file(Path(fn), out_path)
+    if cache.store:
+        # remove evicted as well as orphaned store objects
+        for checksum in cache.store.checksums():
+            if refs[checksum] <= 0:
+                remove_output_file(
+                    cache.store.object_path(checksum), out_path)
+    cache.flush()
+    log.info("cache size after GC: %d bytes", total)
+    return [(cache_name, key) for cache_name, key, _ in evicted]
+
+
+def entry_size(fn, fingerprint=None):
+    """
+    return size of cached file from its entry or 0 if it doesn't exist
+    """
+    if fingerprint:
+        return fingerprint[0]
+    try:
+        return os.lstat(fn).st_size
+    except OSError:
+        return 0
+
+
+def remove_output_file(path, out_path):
+    """
+    remove file, dir or symlink and its empty parent dirs
+    if it's inside out_path
+    """
+    try:
+        # don't follow symlinks such as nix result
+        path.parent.resolve().relative_to(out_path)
+    except ValueError:
+        log.verbose("not removing file outside of output dir: %s", path)
+        return
+    if not os.path.lexists(str(path)):
+        return
+    log.verbose("removing cached file: %s", path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+    parent = path.parent
+    while parent.resolve() != out_path:
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+        parent = parent.parent
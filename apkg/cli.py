@@ -8,6 +8,7 @@ import sys
 import click
 
 from apkg import __version__
+from apkg import cache as _cache
 from apkg import commands
 from apkg import ex
 from apkg.log import getLogger, T
@@ -97,6 +98,8 @@ def cli(log_level='info'):
     _log.set_log_level(level)
     log.verbose("apkg version: %s", __version__)
     log.verbose("log level: %s (%s)", log_level.upper(), _log.LOG_LEVEL)
+    # write all cache changes at once when command finishes
+    click.get_current_context().call_on_close(_cache.flush_all)
 
 
 def apkg(*args):
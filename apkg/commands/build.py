@@ -10,6 +10,7 @@ from apkg.commands.srcpkg import srcpkg as make_srcpkg
 from apkg.log import getLogger
 from apkg.project import Project
 from apkg.util import common
+from apkg.util.digest import write_checksums_files
 import apkg.util.shutil35 as shutil
 
 
@@ -39,6 +40,10 @@ log = getLogger(__name__)
                     "  [default: pkg/srcpkg/DISTRO/NVR]"))
 @click.option('--cache/--no-cache', default=True, show_default=True,
               help="enable/disable cache")
+@click.option('--paranoid-cache', is_flag=True,
+              help="validate cached files using full checksum")
+@click.option('--refresh', is_flag=True,
+              help="check upstream version ignoring cached one")
 @click.option('-F', '--file-list', 'input_file_lists', multiple=True,
               help=("specify text file listing one input file per line"
                     ", use '-' to read from stdin"))
@@ -70,6 +75,8 @@ def build(
         build_dep=False,
         isolated=False,
         cache=True,
+        paranoid_cache=False,
+        refresh=False,
         project=None):
     """
     build packages
@@ -79,7 +86,7 @@ def build(
     proj = project or Project()
     distro = adistro.distro_arg(distro)
     log.info("target distro: %s", distro)
-    use_cache = proj.cache.enabled(cache)
+    use_cache = proj.cache.enabled(cache, paranoid=paranoid_cache)
 
     infiles = common.parse_input_files(input_files, input_file_lists)
 
@@ -100,6 +107,20 @@ def build(
             except ex.DistroNotSupported as e:
                 log.warning("SKIPPING build-dep due to error: %s", e)
 
+    build_cache_name = None
+    if use_cache and not (srcpkg or archive or upstream or version or infiles):
+        # shortcut from current project state directly to packages
+        # without touching archive and source package cache entries,
+        # templates are part of project state
+        build_cache_name = 'build/%s' % distro
+        build_cache_key = '%s:%s' % (proj.checksum, release or '')
+        cached = common.get_cached_paths(
+            proj, build_cache_name, build_cache_key, result_dir)
+        if cached:
+            log.success("reuse %d cached packages", len(cached))
+            write_checksums_files(cached)
+            return cached
+
     if srcpkg:
         if version:
             raise ex.InvalidInput(
@@ -111,6 +132,7 @@ def build(
             input_files=infiles,
             upstream=upstream,
             version=version,
+            refresh=refresh,
             release=release,
             distro=distro,
             project=proj,
@@ -128,7 +150,11 @@ def build(
         cached = common.get_cached_paths(
             proj, cache_name, cache_key, result_dir)
         if cached:
+            if build_cache_name:
+                proj.cache.update_from(
+                    build_cache_name, build_cache_key, cache_name, cache_key)
             log.success("reuse %d cached packages", len(cached))
+            write_checksums_files(cached)
             return cached
 
     # fetch pkgstyle (deb, rpm, arch, ...)
@@ -154,6 +180,10 @@ def build(
         log.info("removing existing result dir: %s", result_path)
         shutil.rmtree(result_path)
 
+    # cache checkpoint: keep archive and srcpkg entries on disk
+    # even if the (potentially long) package build gets killed
+    proj.cache.flush()
+
     # build package using chosen distro packaging style
     pkgs = pkgstyle.build_packages(
         build_path,
@@ -170,13 +200,14 @@ def build(
     # sort output for determinism
     pkgs.sort()
 
-    if use_cache and not upstream:
-        unfiles = [p for p in pkgs if not p.is_file()]
-        if not unfiles:
-            # only cache regular files for now
-            proj.cache.update(
-                cache_name, cache_key, pkgs)
+    if use_cache:
+        proj.cache.update(
+            cache_name, cache_key, pkgs)
+        if build_cache_name:
+            proj.cache.update_from(
+                build_cache_name, build_cache_key, cache_name, cache_key)
 
+    write_checksums_files(pkgs)
     return pkgs
 
 
@@ -122,7 +122,8 @@ def build_dep(
         log.info("build deps from template: %s", template.path)
         deps = call_pkgstyle_fun(
             pkgstyle, 'get_build_deps_from_template',
-            template.path, distro=distro)
+            template.path, distro=distro,
+            jinja_cache_path=template.jinja_cache_path)
 
     if install:
         log.info("installing %s build deps...", len(deps))
@@ -0,0 +1,216 @@
+import json
+import time
+
+import click
+
+from apkg import cache as _cache
+from apkg import cachebundle
+from apkg import cachestore
+from apkg.util import common
+from apkg.log import getLogger
+from apkg.parse import parse_size
+from apkg.project import Project
+
+
+log = getLogger(__name__)
+
+
+@click.group(name='cache')
+@click.help_option('-h', '--help', help='show this help')
+def cli_cache():
+    """
+    manage apkg cache
+    """
+
+
+@cli_cache.command(name='gc')
+@click.option('-s', '--max-size',
+              help=("evict least recently used entries until cache fits"
+                    " into specified size such as 10G"
+                    "  [default: cache.max_size]"))
+@click.option('-a', '--max-age', type=float,
+              help=("evict entries not used for more than specified"
+                    " number of days  [default: cache.max_age]"))
+@click.option('-n', '--dry-run', is_flag=True,
+              help="only print entries to evict")
+@click.help_option('-h', '--help', help='show this help')
+def cli_cache_gc(*args, **kwargs):
+    """
+    evict old cache entries and delete their files
+    """
+    results = cache_gc(*args, **kwargs)
+    common.print_results(results)
+    return results
+
+
+def cache_gc(
+        max_size=None,
+        max_age=None,
+        dry_run=False,
+        project=None):
+    """
+    evict least recently used cache entries and delete their files
+
+    limits default to cache.max_size and cache.max_age config options
+
+    return list of evicted entries in 'CACHE_NAME KEY' format
+    """
+    log.bold("collecting cache garbage")
+    proj = project or Project()
+    if max_size is None:
+        max_size = proj.config_get('cache.max_size')
+    if max_age is None:
+        max_age = proj.config_get('cache.max_age')
+    max_size = parse_size(max_size)
+    if max_size is None and max_age is None:
+        log.warning("no cache limits set - nothing to evict")
+        return []
+    evicted = cachestore.gc(
+        proj.cache, max_size=max_size, max_age=max_age, dry_run=dry_run)
+    if dry_run:
+        log.success("%d cache entries to evict", len(evicted))
+    else:
+        log.success("evicted %d cache entries", len(evicted))
+    return ["%s %s" % e for e in evicted]
+
+
+@cli_cache.command(name='stats')
+@click.option('-n', '--runs', type=int,
+              help="only include specified number of last runs")
+@click.option('--json', 'as_json', is_flag=True,
+              help="print stats in JSON including individual runs")
+@click.help_option('-h', '--help', help='show this help')
+def cli_cache_stats(*args, **kwargs):
+    """
+    show cache hit/miss statistics
+    """
+    stats = cache_stats(*args, **kwargs)
+    if kwargs.get('as_json'):
+        print(json.dumps(stats, indent=2))
+    else:
+        print_stats(stats)
+    return stats
+
+
+def cache_stats(
+        runs=None,
+        as_json=False,  # pylint: disable=unused-argument
+        project=None):
+    """
+    return cache statistics recorded by previous apkg runs
+
+    returns dict with recorded 'runs' and their per cache name 'total'
+    """
+    proj = project or Project()
+    recorded = proj.cache.stats.load_runs()
+    if runs:
+        recorded = recorded[-runs:]
+    return {
+        'runs': recorded,
+        'total': _cache.sum_stats(recorded),
+    }
+
+
+@cli_cache.command(name='export')
+@click.argument('bundle', type=click.Path())
+@click.option('-c', '--cache-name', 'cache_names', multiple=True,
+              help=("only export cache names matching shell-style pattern"
+                    " such as 'archive/*' (can be used multiple times)"))
+@click.help_option('-h', '--help', help='show this help')
+def cli_cache_export(*args, **kwargs):
+    """
+    export cache entries and their files into a bundle
+
+    Bundle is a tar archive compressed according to extension
+    such as cache.tar.gz which can be imported on another machine
+    using apkg cache import.
+    """
+    results = cache_export(*args, **kwargs)
+    common.print_results(results)
+    return results
+
+
+def cache_export(
+        bundle,
+        cache_names=None,
+        project=None):
+    """
+    export cache entries and their files into a bundle
+
+    return list of exported entries in 'CACHE_NAME KEY' format
+    """
+    log.bold("exporting cache bundle: %s", bundle)
+    proj = project or Project()
+    exported = cachebundle.export_bundle(
+        proj.cache, bundle, cache_names=cache_names)
+    log.success("exported %d cache entries to bundle: %s",
+                len(exported), bundle)
+    return ["%s %s" % e for e in exported]
+
+
+@cli_cache.command(name='import')
+@click.argument('bundle', type=click.Path(exists=True))
+@click.help_option('-h', '--help', help='show this help')
+def cli_cache_import(*args, **kwargs):
+    """
+    import cache entries and their files from a bundle
+    """
+    results = cache_import(*args, **kwargs)
+    common.print_results(results)
+    return results
+
+
+def cache_import(
+        bundle,
+        project=None):
+    """
+    import cache entries and their files from a bundle
+
+    return list of imported entries in 'CACHE_NAME KEY' format
+    """
+    log.bold("importing cache bundle: %s", bundle)
+    proj = project or Project()
+    imported = cachebundle.import_bundle(proj.cache, bundle)
+    log.success("imported %d cache entries from bundle: %s",
+                len(imported), bundle)
+    return ["%s %s" % e for e in imported]
+
+
+def print_stats(stats):
+    runs = stats['runs']
+    if not runs:
+        print("no cache stats recorded yet")
+        return
+    fmt = "%-32s %7s %7s %7s %8s %10s %10s %10s"
+    print("cache stats of %d runs since %s\n" % (
+        len(runs), time.strftime('%Y-%m-%d %H:%M',
+                                 time.localtime(runs[0]['time']))))
+    print(fmt % ('cache name', 'hits', 'misses', 'invalid', 'hit rate',
+                 'verified', 'validation', 'saved'))
+    for cache_name, c in sorted(stats['total'].items()):
+        hits = (c.get('hits', 0) + c.get('remote_hits', 0)
+                + c.get('shared_hits', 0))
+        queries = hits + c.get('misses', 0)
+        hit_rate = "%d%%" % (100 * hits / queries) if queries else '-'
+        if c.get('builds'):
+            # estimate based on average time to build missing entry
+            saved = "%.1fs" % (hits * c['build_time'] / c['builds'])
+        else:
+            saved = '-'
+        print(fmt % (
+            cache_name, hits, c.get('misses', 0), c.get('invalid', 0),
+            hit_rate, format_size(c.get('bytes_verified', 0)),
+            "%.3fs" % c.get('validation_time', 0), saved))
+
+
+def format_size(size):
+    for unit in ['B', 'K', 'M', 'G']:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'T'
+    return "%.1f%s" % (size, unit) if unit != 'B' else "%dB" % size
+
+
+APKG_CLI_COMMANDS = [cli_cache]
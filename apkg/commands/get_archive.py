@@ -20,6 +20,10 @@ log = getLogger(__name__)
               help="put results into specified dir")
 @click.option('--cache/--no-cache', default=True, show_default=True,
               help="enable/distable cache")
+@click.option('--paranoid-cache', is_flag=True,
+              help="validate cached files using full checksum")
+@click.option('--refresh', is_flag=True,
+              help="check upstream version ignoring cached one")
 @click.help_option('-h', '--help', help='show this help')
 def cli_get_archive(*args, **kwargs):
     """
@@ -34,6 +38,8 @@ def get_archive(
         version=None,
         result_dir=None,
         cache=True,
+        paranoid_cache=False,
+        refresh=False,
         project=None):
     """
     download upstream archive for current project
@@ -47,15 +53,19 @@ def get_archive(
 
     1) using upstream.version_script if set
     2) from HTML listing if upstream.archive_url is set
+
+    Detected version is cached for upstream.version_cache_ttl seconds,
+    use --refresh to check upstream regardless.
     """
     proj = project or Project()
+    use_cache = proj.cache.enabled(cache, paranoid=paranoid_cache)
     if not version:
-        version = proj.upstream_version
+        version = proj.get_upstream_version(
+            refresh=refresh, use_cache=use_cache)
         if not version:
             raise ex.UnableToDetectUpstreamVersion()
     archive_url = proj.upstream_archive_url(version)
 
-    use_cache = proj.cache.enabled(cache)
     if use_cache:
         cache_name = 'archive/upstream'
         cache_key = archive_url
@@ -93,7 +103,8 @@ def get_archive(
     archive_path = ar_base_path / archive_fn
     log.info('saving archive to: %s', archive_path)
     ar_base_path.mkdir(parents=True, exist_ok=True)
-    archive_path.open('wb').write(r.content)
+    with common.atomic_write(archive_path, mode='wb') as f:
+        f.write(r.content)
     log.success('downloaded archive: %s', archive_path)
     results = [archive_path]
 
@@ -108,7 +119,8 @@ def get_archive(
         _, _, signature_name = signature_url.rpartition('/')
         signature_path = ar_base_path / signature_name
         log.info('saving signature to: %s', signature_path)
-        signature_path.open('wb').write(r.content)
+        with common.atomic_write(signature_path, mode='wb') as f:
+            f.write(r.content)
         log.success('downloaded signature: %s', signature_path)
         results.append(signature_path)
     else:
@@ -34,6 +34,8 @@ log = getLogger(__name__)
               help="override target distro  [default: current]")
 @click.option('--cache/--no-cache', default=True, show_default=True,
               help="enable/disable cache")
+@click.option('--paranoid-cache', is_flag=True,
+              help="validate cached files using full checksum")
 @click.option('--ask/--no-ask', 'interactive',
               default=False, show_default=True,
               help="enable/disable interactive mode")
@@ -72,6 +74,7 @@ def install(
         distro=None,
         build_dep=False,
         cache=True,
+        paranoid_cache=False,
         interactive=False):
     """
     install packages using native package manager
@@ -121,7 +124,8 @@ def install(
             release=release,
             distro=distro,
             build_dep=build_dep,
-            cache=cache)
+            cache=cache,
+            paranoid_cache=paranoid_cache)
 
         result = pkgstyle.call_pkgstyle_fun(
             ps, 'install_custom_packages',
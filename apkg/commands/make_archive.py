@@ -7,6 +7,7 @@ from apkg.cli import cli
 from apkg.util import common
 from apkg.log import getLogger
 from apkg.project import Project
+from apkg.util.digest import copy_file
 from apkg.util.run import run
 import apkg.util.shutil35 as shutil
 
@@ -19,6 +20,8 @@ log = getLogger(__name__)
               help="put results into specified dir")
 @click.option('--cache/--no-cache', default=True, show_default=True,
               help="enable/distable cache")
+@click.option('--paranoid-cache', is_flag=True,
+              help="validate cached files using full checksum")
 @click.help_option('-h', '--help', help='show this help')
 def cli_make_archive(*args, **kwargs):
     """
@@ -32,6 +35,7 @@ def cli_make_archive(*args, **kwargs):
 def make_archive(
         result_dir=None,
         cache=True,
+        paranoid_cache=False,
         project=None):
     """
     create dev archive from current project state
@@ -41,7 +45,7 @@ def make_archive(
     log.bold("creating dev archive")
     proj = project or Project()
 
-    use_cache = proj.cache.enabled(cache)
+    use_cache = proj.cache.enabled(cache, paranoid=paranoid_cache)
     if use_cache:
         cache_name = 'archive/dev'
         cache_key = proj.checksum
@@ -81,7 +85,9 @@ def make_archive(
     if archive_path != in_archive_path:
         log.info("copying archive to: %s", archive_path)
         ar_base_path.mkdir(parents=True, exist_ok=True)
-        shutil.copy(in_archive_path, archive_path)
+        # archive is hashed while copying and replaced atomically
+        copy_file(in_archive_path, archive_path)
+        shutil.copymode(in_archive_path, archive_path)
     log.success("made archive: %s", archive_path)
     results = [archive_path]
     if use_cache:
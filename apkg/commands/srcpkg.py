@@ -11,6 +11,7 @@ from apkg.commands.make_archive import make_archive
 from apkg.log import getLogger
 from apkg.project import Project
 from apkg.util.archive import unpack_archive, get_archive_version
+from apkg.util.digest import write_checksums_files
 import apkg.util.shutil35 as shutil
 
 
@@ -37,6 +38,10 @@ log = getLogger(__name__)
               help="only render source package template")
 @click.option('--cache/--no-cache', default=True, show_default=True,
               help="enable/disable cache")
+@click.option('--paranoid-cache', is_flag=True,
+              help="validate cached files using full checksum")
+@click.option('--refresh', is_flag=True,
+              help="check upstream version ignoring cached one")
 @click.option('-F', '--file-list', 'input_file_lists', multiple=True,
               help=("specify text file listing one input file per line"
                     ", use '-' to read from stdin"))
@@ -62,6 +67,8 @@ def srcpkg(
         result_dir=None,
         render_template=False,
         cache=True,
+        paranoid_cache=False,
+        refresh=False,
         project=None):
     """
     create source package
@@ -82,7 +89,7 @@ def srcpkg(
     proj = project or Project()
     distro = adistro.distro_arg(distro)
     log.info("target distro: %s", distro)
-    use_cache = proj.cache.enabled(cache)
+    use_cache = proj.cache.enabled(cache, paranoid=paranoid_cache)
 
     if not release:
         release = '1'
@@ -100,6 +107,7 @@ def srcpkg(
             infiles = get_archive(
                 version=version,
                 cache=use_cache,
+                refresh=refresh,
                 project=proj)
         else:
             infiles = make_archive(
@@ -121,6 +129,7 @@ def srcpkg(
             proj, cache_name, cache_key, result_dir)
         if cached:
             log.success("reuse cached source package: %s", cached[0])
+            write_checksums_files(cached)
             return cached
 
     if upstream:
@@ -145,7 +154,7 @@ def srcpkg(
     log.info("package archive: %s", ar_path)
 
     # get needed paths
-    pkg_name = ps.get_template_name(template.path)
+    pkg_name = template.name
     nvr = "%s-%s-%s" % (pkg_name, version, release)
     build_path = proj.srcpkg_build_path / distro / nvr
     if result_dir:
@@ -156,8 +165,8 @@ def srcpkg(
     log.info("build dir: %s", build_path)
     log.info("result dir: %s", out_path)
 
-    # prepare new build dir
-    if build_path.exists():
+    # prepare new build dir - template render updates existing one
+    if build_path.exists() and not render_template:
         log.info("removing existing build dir: %s", build_path)
         shutil.rmtree(build_path)
     build_path.mkdir(parents=True, exist_ok=True)
@@ -179,8 +188,11 @@ def srcpkg(
         if result_dir:
             # respect --result-dir when rendering template
             build_path = out_path
-        template.render(build_path, env)
-        log.success("rendered source package template: %s", build_path)
+        # only write changed files, remove stale ones unless in --result-dir
+        r = template.render(build_path, env, prune=not result_dir)
+        log.success("rendered source package template: %s"
+                    " (%d changed, %d unchanged, %d removed)",
+                    build_path, r.changed, r.unchanged, r.removed)
         return [build_path]
 
     # create source package using desired package style
@@ -209,6 +221,7 @@ def srcpkg(
         proj.cache.update(
             cache_name, cache_key, results)
 
+    write_checksums_files(results)
     return results
 
 
@@ -0,0 +1,100 @@
+import click
+
+from apkg import ex
+from apkg.log import getLogger, T
+from apkg import workspace as _workspace
+
+
+log = getLogger(__name__)
+
+
+@click.group(name='workspace')
+@click.help_option('-h', '--help', help='show this help')
+def cli_workspace():
+    """
+    run apkg commands for all projects in a workspace
+    """
+
+
+@cli_workspace.command(name='list')
+@click.argument('path', default='.')
+@click.help_option('-h', '--help', help='show this help')
+def cli_workspace_list(path='.'):
+    """
+    list apkg projects in workspace
+    """
+    for project_path in _workspace.discover_projects(path):
+        print(project_path)
+
+
+def workspace_options(fun):
+    """
+    options common to all workspace commands
+    """
+    options = [
+        click.argument('path', default='.'),
+        click.option('-j', '--jobs', type=int,
+                     help="number of parallel jobs  [default: CPU count]"),
+        click.option('-r', '--release',
+                     help="set packagge release  [default: 1]"),
+        click.option('-d', '--distro',
+                     help="set target distro  [default: current]"),
+        click.option('--cache/--no-cache', default=True, show_default=True,
+                     help="enable/disable cache"),
+        click.option('--shared-store/--no-shared-store',
+                     default=True, show_default=True,
+                     help="share cache store between projects"),
+        click.help_option('-h', '--help', help='show this help'),
+    ]
+    for option in reversed(options):
+        fun = option(fun)
+    return fun
+
+
+@cli_workspace.command(name='srcpkg')
+@workspace_options
+def cli_workspace_srcpkg(*args, **kwargs):
+    """
+    create source packages for all projects in workspace
+    """
+    return workspace_run('srcpkg', *args, **kwargs)
+
+
+@cli_workspace.command(name='build')
+@click.option('-I', '--isolated', is_flag=True,
+              help="use isolated builder (pbuilder, mock, ...)")
+@workspace_options
+def cli_workspace_build(*args, **kwargs):
+    """
+    build packages for all projects in workspace
+    """
+    return workspace_run('build', *args, **kwargs)
+
+
+def workspace_run(command, path='.', jobs=None, shared_store=True,
+                  **kwargs):
+    """
+    run apkg command for all projects in workspace and print results
+
+    raise CommandFailed when command failed for any project
+    """
+    log.bold("running %s in workspace: %s", command, path)
+    results = _workspace.run_workspace_command(
+        path, command, jobs=jobs, share_store=shared_store, **kwargs)
+    failed = 0
+    for project_path, paths, error in results:
+        if error:
+            failed += 1
+            print(T.red("%s: %s" % (project_path, error)))
+            continue
+        for p in paths:
+            print(p)
+    if failed:
+        raise ex.CommandFailed(
+            msg="%s failed for %d of %d projects" % (
+                command, failed, len(results)))
+    log.success("%s finished for %d projects", command, len(results))
+    return results
+
+
+APKG_CLI_COMMANDS = [cli_workspace]
@@ -51,3 +51,22 @@ def parse_version(version_str):
     if version_str.startswith('v'):
         return version_str[1:]
     return version_str
+
+
+def parse_size(size):
+    """
+    parse size in bytes from int or string with optional unit suffix
+
+    examples: 1024, '512K', '10G', '1.5 GB'
+
+    return None for None input
+    """
+    if size is None or isinstance(size, int):
+        return size
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$',
+                 str(size), flags=re.IGNORECASE)
+    if not m:
+        raise ex.InvalidInput(fail="invalid size: %s" % size)
+    num, unit = m.groups()
+    exp = ' KMGT'.index(unit.upper() or ' ')
+    return int(float(num) * 1024 ** exp)
@@ -38,12 +38,48 @@ def get_pkgstyle_for_template(path):
 
 
 def get_pkgstyle_for_distro(distro):
-    distro = distro.lower()
-    for style in PKGSTYLES.values():
-        for sup_distro in style.SUPPORTED_DISTROS:
-            if distro.startswith(sup_distro):
-                return style
-    return None
+    return get_pkgstyle_index().resolve(distro.lower())
+
+
+class DistroIndex:
+    """
+    resolve distro in idver format (such as debian-11) to an item
+
+    Items are registered under distro prefix keys and the longest
+    matching key wins. Versioned keys (such as debian-11) only match on
+    version boundary (debian-11, debian-11.2 but not debian-110) and take
+    precedence over plain prefix keys (such as debian).
+
+    Results are memoized so resolving many distros is cheap.
+    """
+    def __init__(self):
+        self.keys = []
+        self.resolved = {}
+
+    def add(self, key, item, versioned=False):
+        self.keys.append((versioned, key.lower(), item))
+        # versioned first, then longest, stable for equal keys
+        self.keys.sort(key=lambda k: (not k[0], -len(k[1])))
+        self.resolved = {}
+
+    def resolve(self, distro):
+        """
+        return item best matching distro or None
+        """
+        try:
+            return self.resolved[distro]
+        except KeyError:
+            pass
+        item = None
+        for versioned, key, kitem in self.keys:
+            if not distro.startswith(key):
+                continue
+            if versioned and distro[len(key):len(key) + 1] not in '-.':
+                continue
+            item = kitem
+            break
+        self.resolved[distro] = item
+        return item
 
 
 def get_pkgstyle(style):
@@ -68,4 +104,25 @@ def call_pkgstyle_fun(pkgstyle, fun, *args, **kwargs):
     return f(*args, **kwargs)
 
 
+def build_pkgstyle_index(styles):
+    index = DistroIndex()
+    for style in styles.values():
+        for sup_distro in style.SUPPORTED_DISTROS:
+            index.add(sup_distro, style)
+    return index
+
+
+def get_pkgstyle_index():
+    """
+    return DistroIndex of package styles built on first use
+
+    it can't be built on import as pkgstyles import this module
+    """
+    global _PKGSTYLE_INDEX
+    if _PKGSTYLE_INDEX is None:
+        _PKGSTYLE_INDEX = build_pkgstyle_index(PKGSTYLES)
+    return _PKGSTYLE_INDEX
+
+
 PKGSTYLES = import_pkgstyles()
+_PKGSTYLE_INDEX = None
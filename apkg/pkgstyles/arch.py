@@ -14,6 +14,7 @@ import sys
 from apkg import ex
 from apkg.log import getLogger
 from apkg import pkgtemplate
+from apkg.util.digest import copy_file
 from apkg.util.run import cd, run, sudo
 import apkg.util.shutil35 as shutil
 
@@ -56,8 +57,8 @@ def build_srcpkg(
     template.render(build_path, env or {})
     out_path.mkdir(parents=True)
     log.info("copying PKGBUILD and archive to: %s", out_path)
-    shutil.copyfile(in_pkgbuild, out_pkgbuild)
-    shutil.copyfile(archive_path, out_archive)
+    copy_file(in_pkgbuild, out_pkgbuild)
+    copy_file(archive_path, out_archive)
     return [out_pkgbuild, out_archive]
 
 
@@ -83,7 +84,7 @@ def build_packages(
     # find and copy resulting packages
     for src_pkg in glob.iglob('%s/*.zst' % build_path):
         dst_pkg = out_path / Path(src_pkg).name
-        shutil.copyfile(src_pkg, dst_pkg)
+        copy_file(src_pkg, dst_pkg)
         pkgs.append(dst_pkg)
 
     return pkgs
@@ -127,7 +128,9 @@ def get_build_deps_from_template(
     distro = kwargs.get('distro')
     # render PKGBUILD
     this_style = sys.modules[__name__]
-    t = pkgtemplate.PackageTemplate(template_path, style=this_style)
+    t = pkgtemplate.PackageTemplate(
+        template_path, style=this_style,
+        jinja_cache_path=kwargs.get('jinja_cache_path'))
     env = pkgtemplate.DUMMY_ENV.copy()
     if distro:
         env['distro'] = distro
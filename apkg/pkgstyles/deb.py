@@ -24,9 +24,9 @@ from apkg import ex
 from apkg.log import getLogger
 from apkg import parse
 from apkg import pkgtemplate
+from apkg.util.digest import copy_file
 from apkg.util.run import cd, run, sudo
 from apkg.util.archive import unpack_archive
-import apkg.util.shutil35 as shutil
 
 
 log = getLogger(__name__)
@@ -88,7 +88,7 @@ def copy_srcpkg_files(src_path, dst_path):
             '*.diff.*']:
         for f in glob.iglob('%s/%s' % (src_path, pattern)):
             srcp = Path(f)
-            shutil.copyfile(f, dst_path / srcp.name)
+            copy_file(f, dst_path / srcp.name)
 
 
 def build_srcpkg(
@@ -117,7 +117,7 @@ def build_srcpkg(
     debian_ar = "%s_%s.orig%s" % (env['name'], env['version'], ext)
     debian_ar_path = build_path / debian_ar
     log.info("copying archive into source package: %s", debian_ar_path)
-    shutil.copyfile(archive_path, debian_ar_path)
+    copy_file(archive_path, debian_ar_path)
 
     log.info("building deb source-only package...")
     with cd(source_path):
@@ -192,7 +192,7 @@ def build_packages(
     log.info("copying built packages to result dir: %s", out_path)
     for src_pkg in glob.iglob('%s/*.deb' % build_path):
         dst_pkg = out_path / Path(src_pkg).name
-        shutil.copyfile(src_pkg, dst_pkg)
+        copy_file(src_pkg, dst_pkg)
         pkgs.append(dst_pkg)
 
     return pkgs
@@ -280,7 +280,9 @@ def get_build_deps_from_template(
     distro = kwargs.get('distro')
     # render control file
     this_style = sys.modules[__name__]
-    t = pkgtemplate.PackageTemplate(template_path, style=this_style)
+    t = pkgtemplate.PackageTemplate(
+        template_path, style=this_style,
+        jinja_cache_path=kwargs.get('jinja_cache_path'))
     env = pkgtemplate.DUMMY_ENV.copy()
     if distro:
         env['distro'] = distro
@@ -16,9 +16,9 @@ import re
 
 from apkg import ex
 from apkg.log import getLogger
+from apkg.util.digest import copy_file, file_digest
 from apkg.util.run import run
 import apkg.util.shutil35 as shutil
-from apkg.util.common import hash_file
 
 log = getLogger(__name__)
 
@@ -78,13 +78,14 @@ def build_srcpkg(
         env):
     archive_path = archive_paths[0]
     env = env or {}
-    env['src_hash'] = hash_file(archive_path).hexdigest()
+    # nix requires SHA-256
+    env['src_hash'] = file_digest(archive_path, algo='sha256')
     out_archive = out_path / archive_path.name
     log.info("applying templates")
     template.render(build_path, env or {})
     log.info("copying everything to: %s", out_path)
     shutil.copytree(build_path, out_path)
-    shutil.copyfile(archive_path, out_archive)
+    copy_file(archive_path, out_archive)
     return [out_path / 'top-level.nix', out_path / 'default.nix', out_archive]
     # TODO: maybe list everything in the directory?
     #       (e.g. local patches might be there)
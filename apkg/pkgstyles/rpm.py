@@ -23,8 +23,8 @@ from apkg import ex
 from apkg.util import common
 from apkg.log import getLogger
 from apkg import pkgtemplate
+from apkg.util.digest import copy_file
 from apkg.util.run import run, sudo
-import apkg.util.shutil35 as shutil
 
 
 log = getLogger(__name__)
@@ -102,7 +102,7 @@ def build_srcpkg(
     log.info("copying archive files into SOURCES: %s", rpmbuild_src)
     for src_path in archive_paths:
         dst_path = rpmbuild_src / src_path.name
-        shutil.copyfile(src_path, dst_path)
+        copy_file(src_path, dst_path)
     log.info("building .src.rpm using rpmbuild")
     out = run('rpmbuild', '-bs',
               '--define', '_topdir %s' % rpmbuild_topdir.resolve(),
@@ -115,7 +115,7 @@ def build_srcpkg(
         srpm = m.group(1)
         src_srpm = Path(srpm)
         dst_srpm = out_path / src_srpm.name
-        shutil.copyfile(src_srpm, dst_srpm)
+        copy_file(src_srpm, dst_srpm)
         srcpkgs.append(dst_srpm)
     if not srcpkgs:
         raise ex.ParsingFailed(
@@ -152,7 +152,7 @@ def build_packages(
         for rpm in glob.iglob('%s/*.rpm' % build_path):
             src_pkg = Path(rpm)
             dst_pkg = out_path / src_pkg.name
-            shutil.copyfile(src_pkg, dst_pkg)
+            copy_file(src_pkg, dst_pkg)
             pkgs.append(dst_pkg)
     else:
         log.info("starting direct host .rpm build using rpmbuild")
@@ -167,7 +167,7 @@ def build_packages(
             rpm = m.group(1)
             src_pkg = Path(rpm)
             dst_pkg = out_path / src_pkg.name
-            shutil.copyfile(src_pkg, dst_pkg)
+            copy_file(src_pkg, dst_pkg)
             pkgs.append(dst_pkg)
         if not pkgs:
             raise ex.ParsingFailed(
@@ -221,7 +221,9 @@ def get_build_deps_from_template(
     spec_path = get_spec_(template_path).relative_to(template_path)
     # render .spec file
     this_style = sys.modules[__name__]
-    t = pkgtemplate.PackageTemplate(template_path, style=this_style)
+    t = pkgtemplate.PackageTemplate(
+        template_path, style=this_style,
+        jinja_cache_path=kwargs.get('jinja_cache_path'))
     env = pkgtemplate.DUMMY_ENV.copy()
     if distro:
         env['distro'] = distro
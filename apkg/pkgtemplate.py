@@ -1,13 +1,17 @@
 """
 module for handling and rendering apkg package templates
 """
+import collections
 from pathlib import Path
 import re
+import stat
 
 import jinja2
 
 from apkg.log import getLogger
 from apkg import pkgstyle as _pkgstyle
+from apkg.util.common import atomic_write, copy_file
+from apkg.util.digest import file_digest
 import apkg.util.shutil35 as shutil
 
 
@@ -23,6 +27,67 @@ DUMMY_ENV = {
 }
 
 
+# jinja environments of individual templates, see get_jinja_env()
+_JINJA_ENVS = {}
+
+
+def get_jinja_env(template_path, cache_path=None):
+    """
+    return shared jinja2.Environment for rendering template files
+
+    Environment is created once per template dir and bytecode cache dir
+    and it caches compiled templates in memory as well as on disk
+    in cache_path (such as pkg/.jinja-cache) when supplied.
+    Template files can {% include %} or {% extends %} each other.
+    """
+    tpath = str(Path(template_path).resolve())
+    key = (tpath, str(cache_path) if cache_path else None)
+    env = _JINJA_ENVS.get(key)
+    if env is None:
+        bytecode_cache = None
+        if cache_path:
+            try:
+                Path(cache_path).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(
+                    str(cache_path))
+            except OSError as e:
+                log.verbose("unable to use jinja bytecode cache %s: %s",
+                            cache_path, e)
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(tpath),
+            bytecode_cache=bytecode_cache)
+        _JINJA_ENVS[key] = env
+    return env
+
+
+# counts of files by PackageTemplate.render()
+RenderResult = collections.namedtuple(
+    'RenderResult', ['changed', 'unchanged', 'removed'])
+
+
+def read_text(path):
+    """
+    return text file content or None if it doesn't exist
+    """
+    try:
+        with path.open('r') as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def same_file_content(src, dst):
+    """
+    tell if dst exists with same content as src
+    """
+    try:
+        if src.stat().st_size != dst.stat().st_size:
+            return False
+    except OSError:
+        return False
+    return file_digest(src) == file_digest(dst)
+
+
 def default_render_filter(path):
     if str(path).endswith('.patch'):
         return False
@@ -30,9 +95,21 @@ def default_render_filter(path):
 
 
 class PackageTemplate:
-    def __init__(self, path, style=None):
+    def __init__(self, path, style=None, name=None, meta=None,
+                 jinja_cache_path=None):
+        """
+        Args:
+            path: template dir
+            style: pkgstyle module (default: detect from template files)
+            name: package name (default: parse from template files)
+            meta: ProjectMeta to store parsed package name in
+            jinja_cache_path: dir to store compiled templates in
+        """
         self.path = Path(path)
         self.style = style
+        self._name = name
+        self.meta = meta
+        self.jinja_cache_path = jinja_cache_path
 
     @property
     def pkgstyle(self):
@@ -40,18 +117,42 @@ class PackageTemplate:
             self.style = _pkgstyle.get_pkgstyle_for_template(self.path)
         return self.style
 
+    @property
+    def jinja_env(self):
+        return get_jinja_env(self.path, self.jinja_cache_path)
+
+    @property
+    def name(self):
+        """
+        package name as specified in template files
+        """
+        if self._name is None:
+            self._name = self.pkgstyle.get_template_name(self.path)
+            if self.meta:
+                self.meta.set_template_name(self.path, self._name)
+                self.meta.save()
+        return self._name
+
     def render(self, out_path, env,
                render_filter=default_render_filter,
-               includes=None, excludes=None):
+               includes=None, excludes=None,
+               prune=False):
         """
         render package template into specified output directory
 
+        Rendering is incremental: only output files with different
+        content are written and only different permissions are changed
+        so that unchanged files keep their mtime.
+
         Args:
             out_path: output base path
             env: vars available from template
             render_filter: function to determine which files need rendering
             includes: render only files matching these regexes
             excludes: don't render any files matching these regexes
+            prune: remove files in out_path which weren't rendered
+
+        return RenderResult with counts of changed/unchanged/removed files
         """
         def is_included(fn):
             if includes:
@@ -72,6 +173,8 @@ class PackageTemplate:
         else:
             out_path.mkdir(parents=True, exist_ok=True)
 
+        changed = unchanged = removed = 0
+        rendered = set()
         # recursively render all files
         for d, _, files in shutil.walk(self.path):
             rel_dir = Path(d).relative_to(self.path)
@@ -84,27 +187,50 @@ class PackageTemplate:
                 if not is_included(fn):
                     log.verbose("file excluded from render: %s", fn)
                     continue
+                rendered.add(dst)
 
                 # TODO: filtering should be exposed through config
                 if render_filter(src):
-                    log.verbose("rendering file: %s -> %s", src, dst)
-                    t = None
-                    with src.open('r') as srcf:
-                        t = jinja2.Template(srcf.read())
-                    with dst.open('w') as dstf:
-                        dstf.write(t.render(**env) + '\n')
+                    t = self.jinja_env.get_template((rel_dir / fn).as_posix())
+                    content = t.render(**env) + '\n'
+                    if read_text(dst) == content:
+                        log.verbose("rendered file unchanged: %s", dst)
+                        unchanged += 1
+                    else:
+                        log.verbose("rendering file: %s -> %s", src, dst)
+                        with atomic_write(dst, fsync=False) as dstf:
+                            dstf.write(content)
+                        changed += 1
+                elif same_file_content(src, dst):
+                    log.verbose("copied file unchanged: %s", dst)
+                    unchanged += 1
                 else:
                     log.verbose(
                         "copying file without render: %s -> %s", src, dst)
-                    shutil.copyfile(src, dst)
+                    copy_file(src, dst)
+                    changed += 1
                 # preserve original permission
-                dst.chmod(src.stat().st_mode)
+                mode = stat.S_IMODE(src.stat().st_mode)
+                if stat.S_IMODE(dst.stat().st_mode) != mode:
+                    dst.chmod(mode)
+
+        if prune:
+            for d, _, files in shutil.walk(out_path):
+                for fn in files:
+                    path = Path(d) / fn
+                    if path not in rendered:
+                        log.verbose("removing stale rendered file: %s", path)
+                        path.unlink()
+                        removed += 1
+
+        result = RenderResult(changed, unchanged, removed)
+        log.verbose("rendered %d changed and %d unchanged files"
+                    " (%d stale removed)", changed, unchanged, removed)
+        return result
 
     def render_file_content(self, name, env):
         """
         render template file in memory and return its content
         """
-        src = self.path / name
-        with src.open('r') as srcf:
-            t = jinja2.Template(srcf.read())
+        t = self.jinja_env.get_template(Path(name).as_posix())
         return t.render(**env) + '\n'
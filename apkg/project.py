@@ -1,5 +1,4 @@
 import glob
-import hashlib
 from pathlib import Path
 import os
 import re
@@ -14,8 +13,12 @@ except ImportError:
 from apkg import cache as _cache
 from apkg import ex
 from apkg.log import getLogger
+from apkg import pkgstyle
 from apkg import pkgtemplate
-from apkg.util.git import git
+from apkg import projectmeta
+from apkg.util.git import commit_tree, export_ignore_pathspecs
+from apkg.util.git import find_git_repo, git, resolve_ref
+from apkg.util.treehash import tree_hash
 from apkg.util import upstreamversion
 
 
@@ -40,6 +43,16 @@ class Project:
     path = None
     templates_path = None
     cache_path = None
+    cache_db_path = None
+    store_path = None
+    cache_stats_path = None
+    tree_hash_path = None
+    in_flight_path = None
+    digests_path = None
+    upstream_version_path = None
+    meta_path = None
+    jinja_cache_path = None
+    meta = None
     config_base_path = None
     config_path = None
     archive_path = None
@@ -91,8 +104,23 @@ class Project:
         # output: pkg/{src-,}pkg
         self.package_out_path = self.output_path / 'pkgs'
         self.srcpkg_out_path = self.output_path / 'srcpkgs'
-        # cache: pkg/.cache.json
+        # cache: pkg/.cache.json or pkg/.cache.db (cache.backend = "sqlite")
         self.cache_path = self.output_path / '.cache.json'
+        self.cache_db_path = self.output_path / '.cache.db'
+        self.cache_stats_path = self.output_path / '.cache-stats.json'
+        # persisted file digests (cache.persist_digests = true)
+        self.digests_path = self.output_path / '.digests.json'
+        # locks of cache entries being created: pkg/.in-flight
+        self.in_flight_path = self.output_path / '.in-flight'
+        # memoized file hashes for VCS-less project checksum
+        self.tree_hash_path = self.output_path / '.tree-hashes.json'
+        # detected upstream versions: pkg/.upstream-versions.json
+        self.upstream_version_path = \
+            self.output_path / '.upstream-versions.json'
+        # content-addressable store of cached files: pkg/.store
+        self.store_path = self.output_path / '.store'
+        # compiled package templates: pkg/.jinja-cache
+        self.jinja_cache_path = self.output_path / '.jinja-cache'
 
     def load(self,
              input_path=None,
@@ -110,14 +138,26 @@ class Project:
 
         self.config_base_path = self.input_path / 'config'
         self.config_path = self.config_base_path / CONFIG_FN
+        # snapshot of project metadata: pkg/.project-meta.json
+        self.meta_path = self.output_path / '.project-meta.json'
+        self.meta = projectmeta.ProjectMeta(self.meta_path)
         self.load_config()
         self.update_attrs()
         self.update_paths()
+        # templates might have changed with input_path
+        for attr in ['templates', 'template_index']:
+            self.__dict__.pop(attr, None)
 
     def load_config(self):
+        config = self.meta.get_config(self.config_path)
+        if config is not None:
+            self.config = config
+            return True
         if self.config_path.exists():
             log.verbose("loading project config: %s", self.config_path)
             self.config = toml.load(self.config_path.open())
+            self.meta.set_config(self.config_path, self.config)
+            self.meta.save()
             return True
         else:
             log.verbose("project config not found: %s", self.config_path)
@@ -137,6 +177,30 @@ class Project:
                 return None
         return c
 
+    @cached_property
+    def git_repo(self):
+        """
+        (worktree top dir, git dir) of project git repo
+
+        found without running git, (None, None) when not in a git repo
+        """
+        return find_git_repo(self.path)
+
+    @property
+    def git_dir(self):
+        """
+        path to project .git dir or None when not in a git repo
+        """
+        return self.git_repo[1]
+
+    @property
+    def git_subdir(self):
+        """
+        tell if project is in a subdir of its git repo (such as monorepo)
+        """
+        top = self.git_repo[0]
+        return bool(top) and not os.path.samefile(top, str(self.path))
+
     @cached_property
     def vcs(self):
         """
@@ -144,8 +208,7 @@ class Project:
 
         possible outputs: 'git', None
         """
-        o = git('rev-parse', silent=True, fatal=False)
-        if o.return_code == 0:
+        if self.git_dir:
             return 'git'
         return None
 
@@ -154,16 +217,79 @@ class Project:
         """
         checksum of current project state
 
-        requires VCS (git), only computed once
+        based on git commit and working tree state when available,
+        otherwise content hash of project tree, only computed once
         """
         if self.vcs == 'git':
-            checksum = git.current_commit()[:10]
-            diff = git('diff', log_cmd=False)
-            if diff:
-                diff_hash = hashlib.sha256(diff.encode('utf-8'))
-                checksum += '-%s' % diff_hash.hexdigest()[:10]
-            return checksum
-        return None
+            try:
+                return self.git_checksum()
+            except ex.CommandNotFound:
+                log.verbose("git not available - using tree hash")
+        return 'tree-%s' % self.tree_checksum[:20]
+
+    def git_checksum(self):
+        """
+        checksum of current project state based on git
+
+        HEAD is resolved without running git, git is only used
+        to compute tree of working tree state
+        """
+        index_path = os.path.join(self.git_dir, 'index')
+        # tree including working tree changes and untracked files
+        # except for apkg output
+        excludes = [os.path.relpath(str(self.output_path))]
+        if self.config_get('project.archive_export_ignore'):
+            excludes += export_ignore_pathspecs(
+                self.path / '.gitattributes')
+        commit = resolve_ref(self.git_dir)
+        if (self.archive_paths or len(excludes) > 1 or not commit
+                or self.git_subdir):
+            # only archive paths (or project subdir) are relevant - don't
+            # include commit so that unrelated commits don't change checksum
+            paths = [os.path.relpath(str(self.path / p))
+                     for p in self.archive_paths or ['.']]
+            tree = git.worktree_tree(
+                paths=paths, excludes=excludes, index_path=index_path)
+            return 'tree-%s' % tree[:20]
+        head_tree = commit_tree(self.git_dir, commit)
+        if not head_tree:
+            # packed commit object
+            head_tree = git('rev-parse', '%s^{tree}' % commit, log_cmd=False)
+        checksum = commit[:10]
+        tree = git.worktree_tree(excludes=excludes, index_path=index_path)
+        if tree != head_tree:
+            checksum += '-%s' % tree[:10]
+        return checksum
+
+    @cached_property
+    def archive_paths(self):
+        """
+        existing paths relevant to project archive or None for all
+
+        set by project.archive_paths config option,
+        project input dir (distro/) is always included
+        """
+        paths = self.config_get('project.archive_paths')
+        if not paths:
+            return None
+        input_path = os.path.relpath(str(self.input_path), str(self.path))
+        paths = list(paths)
+        if input_path not in paths:
+            paths.append(input_path)
+        return [p for p in paths if os.path.lexists(str(self.path / p))]
+
+    @cached_property
+    def tree_checksum(self):
+        """
+        VCS-independent content hash of project tree
+
+        output dir and files ignored by .gitignore are excluded
+        and only project.archive_paths are included when set
+        """
+        return tree_hash(self.path,
+                         include=self.archive_paths,
+                         exclude=[self.output_path],
+                         memo_path=self.tree_hash_path)
 
     def upstream_archive_url(self, version):
         url = self.config_get('upstream.archive_url')
@@ -190,17 +316,42 @@ class Project:
 
         possible outputs: version, None
         """
+        return self.get_upstream_version()
+
+    @cached_property
+    def upstream_version_cache(self):
+        """
+        persistent cache of detected upstream versions
+        """
+        ttl = self.config_get('upstream.version_cache_ttl')
+        if ttl is None:
+            ttl = upstreamversion.DEFAULT_CACHE_TTL
+        return upstreamversion.VersionCache(
+            self.upstream_version_path, ttl=ttl)
+
+    def get_upstream_version(self, refresh=False, use_cache=True):
+        """
+        check latest upstream version
+
+        cached version is reused for upstream.version_cache_ttl seconds
+        unless refresh is requested or use_cache is disabled
+
+        possible outputs: version, None
+        """
+        cache = self.upstream_version_cache if use_cache else None
         uv_script = self.config_get('upstream.version_script')
         if uv_script:
             v = upstreamversion.version_from_script(
-                uv_script, script_name='upstream.version_script')
+                uv_script, script_name='upstream.version_script',
+                cache=cache, refresh=refresh)
             log.info("detected upstream version (from script): %s", v)
             return v
         ar_url = self.upstream_archive_url('VERSION')
         if ar_url:
             m = re.match(r'(.*/)[^/]+', ar_url)
             ar_base_url = m.group(1)
-            v = upstreamversion.version_from_listing(ar_base_url)
+            v = upstreamversion.version_from_listing(
+                ar_base_url, cache=cache, refresh=refresh)
             log.info("detected upstream version: %s", v)
             return v
         return None
@@ -208,22 +359,53 @@ class Project:
     @cached_property
     def templates(self):
         if self.templates_path.exists():
-            return load_templates(self.templates_path)
+            templates = load_templates(
+                self.templates_path, meta=self.meta,
+                jinja_cache_path=self.jinja_cache_path)
+            if self.meta:
+                self.meta.save()
+            return templates
         else:
             return []
 
-    def _get_template_for_distro(self, distro):
+    @cached_property
+    def template_index(self):
+        """
+        DistroIndex resolving distro to package template
+
+        Template named after a distro with version (such as debian-11)
+        is used for that distro version, template named after a distro
+        (such as debian) is used for distros starting with its name and
+        other templates (such as deb) are used for all distros supported
+        by their package style.
+
+        Distro templates are also used for other distros supported by
+        their package style when there is no better match.
+        """
+        index = pkgstyle.DistroIndex()
+        generic = []
+        distro = []
         for t in self.templates:
-            ps = t.pkgstyle
-            for d in ps.SUPPORTED_DISTROS:
-                # NOTE: this is very simplistic
-                if d in distro:
-                    return t
-        return None
+            name = t.path.name.lower()
+            if not any(name.startswith(d)
+                       for d in t.pkgstyle.SUPPORTED_DISTROS):
+                generic.append(t)
+                continue
+            if re.search(r'-\d', name):
+                index.add(name, t, versioned=True)
+            else:
+                index.add(name, t)
+            distro.append(t)
+        # order matters as the first of equal keys wins:
+        # distro names, then style templates, then distro style fallback
+        for t in generic + distro:
+            for d in t.pkgstyle.SUPPORTED_DISTROS:
+                index.add(d, t)
+        return index
 
     def get_template_for_distro(self, distro):
         ldistro = distro.lower()
-        template = self._get_template_for_distro(ldistro)
+        template = self.template_index.resolve(ldistro)
         if not template:
             tdir = self.templates_path
             msg = ("missing package template for distro: %s\n\n"
@@ -242,13 +424,37 @@ class Project:
         return glob.glob("%s/%s*" % (ar_path, name))
 
 
-def load_templates(path):
+def load_templates(path, meta=None, jinja_cache_path=None):
+    """
+    load package templates from path
+
+    ProjectMeta snapshot is used to skip template discovery when supplied,
+    compiled templates are stored in jinja_cache_path when supplied
+    """
+    dirs = meta.get_template_dirs(path) if meta else None
+    if dirs is None:
+        dirs = sorted(e.name for e in os.scandir(str(path))
+                      if e.is_dir() and not e.name.startswith('.'))
+        if meta:
+            meta.set_template_dirs(path, dirs)
     templates = []
-    for entry_path in glob.glob('%s/*' % path):
-        if os.path.isdir(entry_path):
-            template = pkgtemplate.PackageTemplate(entry_path)
-            if template.pkgstyle:
-                templates.append(template)
-            else:
-                log.warning("ignoring unknown package style in %s", entry_path)
+    for entry in dirs:
+        entry_path = os.path.join(str(path), entry)
+        info = meta.get_template(entry_path) if meta else None
+        if info:
+            template = pkgtemplate.PackageTemplate(
+                entry_path,
+                style=pkgstyle.get_pkgstyle(info['style']),
+                name=info['name'],
+                meta=meta,
+                jinja_cache_path=jinja_cache_path)
+        else:
+            template = pkgtemplate.PackageTemplate(
+                entry_path, meta=meta, jinja_cache_path=jinja_cache_path)
+            if template.pkgstyle and meta:
+                meta.set_template(entry_path, template.pkgstyle.name)
+        if template.pkgstyle:
+            templates.append(template)
+        else:
+            log.warning("ignoring unknown package style in %s", entry_path)
     return templates
@@ -0,0 +1,181 @@
+"""
+persisted snapshot of project metadata for fast startup
+
+Discovering project metadata involves parsing project config, probing
+template dirs with all package styles and parsing template names from
+packaging files (or even running bash for PKGBUILD).
+
+Results are stored in `pkg/.project-meta.json` along with fingerprints
+(size and mtime) of files they were obtained from so that they can be
+revalidated using a few stat calls on subsequent runs.
+
+Snapshot is discarded on apkg version change.
+"""
+import json
+import os
+import time
+
+from apkg import __version__
+from apkg.log import getLogger
+from apkg.util.common import atomic_write
+from apkg.util.digest import RACY_NS
+
+
+log = getLogger(__name__)
+
+
+def file_fingerprint(path):
+    """
+    return [size, mtime_ns] of a file or None if it doesn't exist
+    """
+    try:
+        st = os.stat(str(path))
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def template_fingerprint(path):
+    """
+    return fingerprint of template dir and files directly in it
+
+    package styles only look at top-level template files to detect style
+    and template name so changes deeper in the tree aren't relevant
+    """
+    try:
+        st = os.stat(str(path))
+        entries = sorted(
+            [e.name, e.is_dir()] + file_fingerprint(e.path)
+            for e in os.scandir(str(path)))
+    except (OSError, TypeError):
+        return None
+    return [st.st_mtime_ns, entries]
+
+
+def newest_mtime(fingerprint):
+    """
+    return newest mtime_ns in file or template fingerprint
+    """
+    if isinstance(fingerprint[1], list):
+        return max([fingerprint[0]] + [e[3] for e in fingerprint[1]])
+    return fingerprint[1]
+
+
+def is_racy(fingerprint):
+    """
+    tell if fingerprint contains mtime too recent to be trusted
+
+    modifications within timestamp resolution might not change mtime
+    """
+    # NOTE(py35): use time.time_ns() when py3.5 support is dropped
+    now = int(time.time() * 10**9)
+    return now - newest_mtime(fingerprint) < RACY_NS
+
+
+class ProjectMeta:
+    """
+    project metadata snapshot with cheap revalidation
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.dirty = False
+
+    def load(self):
+        if self.data is not None:
+            return
+        self.data = {}
+        if not self.path.exists():
+            return
+        try:
+            data = json.load(self.path.open())
+        except (OSError, ValueError) as e:
+            log.verbose("ignoring invalid project metadata snapshot %s: %s",
+                        self.path, e)
+            return
+        if data.get('apkg_version') != __version__:
+            log.verbose("ignoring project metadata snapshot"
+                        " from different apkg version")
+            return
+        self.data = data
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.data['apkg_version'] = __version__
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_write(self.path) as f:
+                json.dump(self.data, f)
+        except (OSError, TypeError, ValueError) as e:
+            # TypeError: config with values unsupported by JSON
+            log.verbose("unable to save project metadata snapshot %s: %s",
+                        self.path, e)
+        self.dirty = False
+
+    def _get(self, section, key, fingerprint):
+        self.load()
+        entry = self.data.get(section, {}).get(key)
+        if entry and fingerprint and entry['fingerprint'] == fingerprint:
+            return entry
+        return None
+
+    def _set(self, section, key, fingerprint, **kwargs):
+        if not fingerprint or is_racy(fingerprint):
+            return
+        self.load()
+        entry = dict(fingerprint=fingerprint, **kwargs)
+        self.data.setdefault(section, {})[key] = entry
+        self.dirty = True
+
+    def get_config(self, config_path):
+        """
+        return cached config or None
+        """
+        entry = self._get(
+            'config', str(config_path), file_fingerprint(config_path))
+        if entry:
+            log.verbose("using cached project config: %s", config_path)
+            return entry['config']
+        return None
+
+    def set_config(self, config_path, config):
+        self._set('config', str(config_path),
+                  file_fingerprint(config_path), config=config)
+
+    def get_template_dirs(self, templates_path):
+        """
+        return cached list of template dir names or None
+        """
+        entry = self._get('template_dirs', str(templates_path),
+                          file_fingerprint(templates_path))
+        if entry:
+            return entry['dirs']
+        return None
+
+    def set_template_dirs(self, templates_path, dirs):
+        self._set('template_dirs', str(templates_path),
+                  file_fingerprint(templates_path), dirs=dirs)
+
+    def get_template(self, template_path):
+        """
+        return cached template info dict or None
+
+        keys: style, name (None when not yet known)
+        """
+        return self._get('templates', str(template_path),
+                         template_fingerprint(template_path))
+
+    def set_template(self, template_path, style, name=None):
+        self._set('templates', str(template_path),
+                  template_fingerprint(template_path),
+                  style=style, name=name)
+
+    def set_template_name(self, template_path, name):
+        """
+        store lazily parsed template name of a cached template
+        """
+        entry = self.get_template(template_path)
+        if entry:
+            entry['name'] = name
+            self.dirty = True
@@ -0,0 +1,288 @@
+"""
+apkg remote cache tier shared between multiple machines
+
+Remote cache stores cache entries under the same cache names and keys as
+local project cache so that apkg on one machine (such as CI runner) can
+reuse archives and packages built on another.
+
+Supported remotes:
+
+* shared directory: `/path/to/dir` or `file:///path/to/dir`
+* HTTP server supporting GET, HEAD and PUT: `https://cache.example/apkg`
+
+Remote layout:
+
+* `objects/CHECKSUM`: cached file contents
+* `entries/PROJECT/HASH.json`: manifest of cached files for a cache entry
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import requests
+
+from apkg.cachestore import file_checksum, is_file_checksum
+from apkg.log import getLogger
+from apkg.util.common import atomic_write
+import apkg.util.shutil35 as shutil
+
+
+log = getLogger(__name__)
+
+
+# environment variable overriding cache.remote config option
+REMOTE_ENV_VAR = 'APKG_CACHE_REMOTE'
+# timeout of HTTP remote requests in seconds (connect, read)
+HTTP_TIMEOUT = (10, 60)
+
+
+class DirRemote:
+    """
+    remote cache in a shared directory (such as NFS mount)
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def exists(self, name):
+        return (self.path / name).exists()
+
+    def get_bytes(self, name):
+        src = self.path / name
+        if not src.exists():
+            return None
+        return src.open('rb').read()
+
+    def put_bytes(self, name, data):
+        with atomic_write(self.path / name, mode='wb') as f:
+            f.write(data)
+
+    def get_file(self, name, dst):
+        src = self.path / name
+        if not src.exists():
+            return False
+        with atomic_write(dst, mode='wb') as f, src.open('rb') as srcf:
+            shutil.copyfileobj(srcf, f)
+        return True
+
+    def put_file(self, name, src):
+        dst = self.path / name
+        with atomic_write(dst, mode='wb') as f, open(str(src), 'rb') as srcf:
+            shutil.copyfileobj(srcf, f)
+
+
+class HTTPRemote:
+    """
+    remote cache on HTTP server supporting GET, HEAD and PUT
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def __str__(self):
+        return self.url
+
+    def exists(self, name):
+        r = requests.head('%s/%s' % (self.url, name), allow_redirects=True,
+                          timeout=HTTP_TIMEOUT)
+        return r.status_code == 200
+
+    def get_bytes(self, name):
+        r = requests.get('%s/%s' % (self.url, name), timeout=HTTP_TIMEOUT)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.content
+
+    def put_bytes(self, name, data):
+        r = requests.put('%s/%s' % (self.url, name), data=data,
+                         timeout=HTTP_TIMEOUT)
+        r.raise_for_status()
+
+    def get_file(self, name, dst):
+        r = requests.get('%s/%s' % (self.url, name), stream=True,
+                         timeout=HTTP_TIMEOUT)
+        if r.status_code == 404:
+            return False
+        r.raise_for_status()
+        with atomic_write(dst, mode='wb') as f:
+            for chunk in r.iter_content(chunk_size=128 * 1024):
+                f.write(chunk)
+        return True
+
+    def put_file(self, name, src):
+        with open(str(src), 'rb') as f:
+            r = requests.put('%s/%s' % (self.url, name), data=f,
+                             timeout=HTTP_TIMEOUT)
+        r.raise_for_status()
+
+
+def new_remote(location):
+    """
+    create remote storage for specified URL or path
+    """
+    if location.startswith('http://') or location.startswith('https://'):
+        return HTTPRemote(location)
+    if location.startswith('file://'):
+        location = location[len('file://'):]
+    return DirRemote(location)
+
+
+class RemoteCache:
+    """
+    remote tier of project cache
+
+    paths of cached files are stored relative to project path
+    so that they're valid in other checkouts of the project
+    """
+    def __init__(self, project, remote, push=True, store=None):
+        self.project = project
+        self.remote = remote
+        self.push_enabled = push
+        # local apkg.cachestore.ArtifactStore to restore files from
+        self.store = store
+
+    def manifest_name(self, cache_name, key):
+        h = hashlib.sha256(('%s\0%s' % (cache_name, key)).encode('utf-8'))
+        return 'entries/%s/%s.json' % (self.project.name, h.hexdigest())
+
+    @staticmethod
+    def object_name(checksum):
+        return 'objects/%s' % checksum
+
+    def relpath(self, path):
+        """
+        return path relative to project or None when it's outside
+        """
+        try:
+            return str(Path(path).resolve().relative_to(
+                self.project.path.resolve()))
+        except ValueError:
+            return None
+
+    def pull(self, cache_name, key):
+        """
+        download cached files from remote
+
+        return list of paths or None on cache miss
+        """
+        try:
+            data = self.remote.get_bytes(self.manifest_name(cache_name, key))
+            if data is None:
+                log.verbose("remote cache miss for %s: %s", cache_name, key)
+                return None
+            manifest = json.loads(data.decode('utf-8'))
+            paths = []
+            for rel_fn, checksum in manifest['files']:
+                path = self.project.path / rel_fn
+                if self.relpath(path) is None:
+                    log.warning("remote cache file outside of project: %s",
+                                rel_fn)
+                    return None
+                if not self.fetch(checksum, path):
+                    return None
+                paths.append(path)
+        except (OSError, ValueError, KeyError,
+                requests.RequestException) as e:
+            log.warning("remote cache %s failed: %s", self.remote, e)
+            return None
+        log.success("pulled %d files from remote cache for %s",
+                    len(paths), cache_name)
+        return paths
+
+    def fetch(self, checksum, path):
+        """
+        make sure path contains file with checksum
+
+        file is restored from local store when possible
+        and only downloaded from remote otherwise
+
+        return True on success
+        """
+        if path.exists() and file_checksum(path) == checksum:
+            return True
+        if self.store and self.store.restore(path, checksum):
+            return True
+        log.info("downloading from remote cache: %s", path)
+        return self.download(checksum, path)
+
+    def download(self, checksum, path):
+        """
+        download remote object into path
+
+        object is downloaded next to path and verified before it replaces
+        path so that invalid object never overwrites a good local file
+
+        return True on success
+        """
+        tmp = path.with_name('.%s.remote.tmp' % path.name)
+        try:
+            if not self.remote.get_file(self.object_name(checksum), tmp):
+                log.warning("missing remote cache object: %s", checksum)
+                return False
+            if file_checksum(tmp, memo=False) != checksum:
+                log.warning("invalid remote cache object: %s", checksum)
+                return False
+            os.replace(str(tmp), str(path))
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return True
+
+    def push(self, cache_name, key, entries):
+        """
+        upload cache entry and its files to remote
+        """
+        if not self.push_enabled:
+            return False
+        files = []
+        for fn, checksum, *_ in entries:
+            if not is_file_checksum(checksum):
+                log.verbose("not pushing to remote cache, only regular"
+                            " files are supported: %s", fn)
+                return False
+            rel_fn = self.relpath(fn)
+            if not rel_fn:
+                log.verbose("not pushing to remote cache, file is outside"
+                            " of project: %s", fn)
+                return False
+            files.append([rel_fn, checksum])
+        manifest = {
+            'cache_name': cache_name,
+            'key': key,
+            'files': files,
+        }
+        try:
+            for (_, checksum), (fn, *_) in zip(files, entries):
+                name = self.object_name(checksum)
+                if not self.remote.exists(name):
+                    log.verbose("uploading to remote cache: %s", fn)
+                    self.remote.put_file(name, fn)
+            self.remote.put_bytes(
+                self.manifest_name(cache_name, key),
+                json.dumps(manifest).encode('utf-8'))
+        except (OSError, requests.RequestException) as e:
+            log.warning("remote cache %s push failed: %s", self.remote, e)
+            return False
+        log.verbose("pushed %s to remote cache: %s", cache_name, key)
+        return True
+
+
+def get_remote_cache(project, store=None):
+    """
+    return RemoteCache for project if configured or None
+
+    optional store is used to avoid downloading files present in it
+    """
+    location = (os.environ.get(REMOTE_ENV_VAR)
+                or project.config_get('cache.remote'))
+    if not location:
+        return None
+    push = project.config_get('cache.remote_push')
+    if push is None:
+        push = True
+    log.verbose("remote cache: %s (push: %s)", location, push)
+    return RemoteCache(
+        project, new_remote(location), push=push, store=store)
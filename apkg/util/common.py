@@ -1,6 +1,8 @@
 from contextlib import contextmanager
+import fcntl
 from pathlib import Path
 import hashlib
+import os
 import sys
 import tempfile
 
@@ -12,9 +14,59 @@ import apkg.util.shutil35 as shutil
 log = getLogger(__name__)
 
 
+# linux ioctl to clone file extents (reflink) on supporting filesystems
+FICLONE = 0x40049409
+# read buffer size used for hashing files
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def reflink_file(src, dst):
+    """
+    create dst as a copy-on-write clone (reflink) of src
+
+    raise OSError when not supported by filesystem
+    """
+    # NOTE(py35): explicit Path -> str conversion for python 3.5
+    with open(str(src), 'rb') as srcf, open(str(dst), 'wb') as dstf:
+        try:
+            fcntl.ioctl(dstf.fileno(), FICLONE, srcf.fileno())
+        except OSError:
+            os.unlink(str(dst))
+            raise
+    shutil.copymode(src, dst)
+
+
+def clone_file(src, dst):
+    """
+    make dst a reflink of src or a copy when reflink isn't possible
+
+    dst is a new inode atomically replacing existing dst so modifying
+    either file in place never affects the other one
+
+    return method used: 'reflink' or 'copy'
+    """
+    dst = Path(dst)
+    tmp = dst.with_name('.%s.clone.tmp' % dst.name)
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        reflink_file(src, tmp)
+        method = 'reflink'
+    except OSError:
+        copy_file(src, tmp)
+        shutil.copymode(src, tmp)
+        method = 'copy'
+    os.replace(str(tmp), str(dst))
+    return method
+
+
 def copy_paths(paths, dst):
     """
     utility to copy a list of paths to dst
+
+    files are reflinked when possible (copied otherwise),
+    symlinks (such as nix result) are recreated and dirs are copied
+    recursively
     """
     if not dst.exists():
         dst.mkdir(parents=True, exist_ok=True)
@@ -23,11 +75,24 @@ def copy_paths(paths, dst):
     for p in paths:
         if p.parent.resolve() == dst_full:
             new_paths.append(p)
+            continue
+        p_dst = dst / p.name
+        if p.is_symlink():
+            tmp = p_dst.with_name('.%s.link.tmp' % p_dst.name)
+            if os.path.lexists(str(tmp)):
+                tmp.unlink()
+            os.symlink(os.readlink(str(p)), str(tmp))
+            os.replace(str(tmp), str(p_dst))
+            log.verbose("symlink: %s -> %s", p, p_dst)
+        elif p.is_dir():
+            if p_dst.exists():
+                shutil.rmtree(p_dst)
+            shutil.copytree(p, p_dst, symlinks=True, copy_function=clone_file)
+            log.verbose("copy dir: %s -> %s", p, p_dst)
         else:
-            p_dst = dst / p.name
-            log.verbose("copying file: %s -> %s", p, p_dst)
-            shutil.copy(p, p_dst)
-            new_paths.append(p_dst)
+            method = clone_file(p, p_dst)
+            log.verbose("%s file: %s -> %s", method, p, p_dst)
+        new_paths.append(p_dst)
     return new_paths
 
 
@@ -110,18 +175,97 @@ def text_tempfile(text, prefix='apkg_tmp_'):
         path.unlink()
 
 
+@contextmanager
+def atomic_write(path, mode='w', fsync=True):
+    """
+    open a temporary file to be atomically renamed to path on success
+
+    file content is fsync-ed before rename so that readers as well as
+    crashes and interrupts only ever see either old or new file content,
+    use fsync=False when protection against crashes isn't needed
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        file_mode = path.stat().st_mode & 0o7777
+    else:
+        # temporary files are private, use default mode instead
+        umask = os.umask(0)
+        os.umask(umask)
+        file_mode = 0o666 & ~umask
+    f = tempfile.NamedTemporaryFile(
+        mode=mode, dir=str(path.parent), prefix='.%s.' % path.name,
+        suffix='.tmp', delete=False)
+    try:
+        with f:
+            yield f
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.chmod(f.name, file_mode)
+        os.replace(f.name, str(path))
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    hold advisory (fcntl) lock on path while in context
+
+    lock file is created if needed and blocks until lock is acquired
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def copy_file(src, dst, algo='sha256'):
+    """
+    copy file contents and compute their digest in a single pass
+
+    dst is atomically replaced instead of being written into
+    so other hardlinks of dst are never modified
+
+    see apkg.util.digest.copy_file() for memoized digest
+
+    return hex digest of file contents
+    """
+    h = hashlib.new(algo)
+    b = bytearray(HASH_BUFFER_SIZE)
+    mv = memoryview(b)
+    # NOTE(py35): explicit Path -> str conversion for python 3.5
+    with open(str(src), 'rb', buffering=0) as fsrc, \
+            atomic_write(dst, mode='wb', fsync=False) as fdst:
+        for n in iter(lambda: fsrc.readinto(mv), 0):
+            h.update(mv[:n])
+            fdst.write(mv[:n])
+    return h.hexdigest()
+
+
 def hash_file(filename, algo='sha256'):
     """
     return hashlib's hash computed over the contents of the specified file
 
     typical use case: `file_hash('/path').hexdigest()`
+
+    see apkg.util.digest for memoized file digests
     """
-    # Code taken from https://stackoverflow.com/a/44873382/587396
-    h = getattr(hashlib, algo)()
-    b = bytearray(128*1024)
-    mv = memoryview(b)
     # NOTE(py35): explicit Path -> str conversion for python 3.5
     with open(str(filename), 'rb', buffering=0) as f:
+        if hasattr(hashlib, 'file_digest'):
+            # python >= 3.11 reads into a reusable buffer without GIL
+            return hashlib.file_digest(f, algo)
+        # Code taken from https://stackoverflow.com/a/44873382/587396
+        h = hashlib.new(algo)
+        b = bytearray(HASH_BUFFER_SIZE)
+        mv = memoryview(b)
         for n in iter(lambda: f.readinto(mv), 0):
             h.update(mv[:n])
     return h
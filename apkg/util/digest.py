@@ -0,0 +1,234 @@
+"""
+process-wide registry of file digests
+
+Digests are memoized by file stat (device, inode, size, mtime) so that
+each file is only read once per apkg run even when its digest is
+requested repeatedly such as when the same archive is used to compute
+cache keys and to validate cache entries.
+
+Digests of files modified within RACY_NS aren't memoized as further
+modification might not change their stat.
+
+Memoized digests can also be persisted between runs using
+load() and save().
+
+Use SHA-256 where file formats and other tools require it and
+INTERNAL_ALGO (BLAKE2b) for digests only used internally by apkg.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+from apkg.log import getLogger
+from apkg.util import common
+from apkg.util.common import atomic_write, hash_file
+
+
+log = getLogger(__name__)
+
+
+DEFAULT_ALGO = 'sha256'
+INTERNAL_ALGO = 'blake2b'
+# files modified this recently aren't memoized or persisted because their
+# mtime might not change on further modification within timestamp resolution
+RACY_NS = 2 * 10**9
+# name of checksums file written into result dirs
+CHECKSUMS_FN = 'SHA256SUMS'
+# maximum number of persisted digests
+MAX_PERSISTED = 10000
+# maximum number of threads hashing files in parallel,
+# hashlib releases GIL so that I/O and hashing of multiple files overlap
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+
+def is_racy(st):
+    """
+    tell if file stat has mtime too recent to memoize its digest
+    """
+    # NOTE(py35): use time.time_ns() when py3.5 support is dropped
+    return int(time.time() * 10**9) - st.st_mtime_ns <= RACY_NS
+
+
+class DigestRegistry:
+    """
+    memoized file digests: (dev, ino, size, mtime_ns, algo) -> hex digest
+    """
+    def __init__(self):
+        self.digests = {}
+        # last use times of digests for pruning persisted ones
+        self.used = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def digest(self, path, algo=DEFAULT_ALGO, memo=True):
+        """
+        return hex digest of file contents
+
+        memo=False forces reading the file even if its digest is known
+        """
+        # NOTE(py35): explicit Path -> str conversion for python 3.5
+        st = os.stat(str(path))
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, algo)
+        racy = is_racy(st)
+        if memo and not racy:
+            with self.lock:
+                d = self.digests.get(key)
+            if d:
+                self.used[key] = time.time()
+                return d
+        d = hash_file(path, algo=algo).hexdigest()
+        if not racy:
+            self._set(key, d)
+        return d
+
+    def _set(self, key, digest):
+        with self.lock:
+            self.digests[key] = digest
+            self.used[key] = time.time()
+            self.dirty = True
+
+    def register(self, path, digest, algo=DEFAULT_ALGO):
+        """
+        remember known digest of a file such as one computed while copying
+
+        recently modified files are ignored, see RACY_NS
+        """
+        st = os.stat(str(path))
+        if is_racy(st):
+            return
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, algo)
+        self._set(key, digest)
+
+    def clear(self):
+        with self.lock:
+            self.digests = {}
+            self.used = {}
+
+    def load(self, path):
+        """
+        load persisted digests from JSON file
+        """
+        if not path.exists():
+            return
+        try:
+            with path.open('r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.verbose("ignoring invalid digest cache %s: %s", path, e)
+            return
+        with self.lock:
+            for *key, d, used in data.get('digests', []):
+                key = tuple(key)
+                if key not in self.digests:
+                    self.digests[key] = d
+                    self.used[key] = used
+        log.verbose("loaded %d digests: %s", len(self.digests), path)
+
+    def save(self, path):
+        """
+        persist known digests of files which weren't modified recently
+        """
+        if not self.dirty:
+            return
+        now = time.time()
+        with self.lock:
+            keys = [k for k in self.digests
+                    if now * 10**9 - k[3] > RACY_NS]
+            keys.sort(key=lambda k: self.used.get(k, 0), reverse=True)
+            data = [list(k) + [self.digests[k], self.used.get(k, now)]
+                    for k in keys[:MAX_PERSISTED]]
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_write(path) as f:
+                json.dump({'digests': data}, f)
+        except OSError as e:
+            log.verbose("unable to save digest cache %s: %s", path, e)
+            return
+        self.dirty = False
+
+
+REGISTRY = DigestRegistry()
+
+
+def file_digest(path, algo=DEFAULT_ALGO, memo=True):
+    """
+    return memoized hex digest of file contents
+
+    see DigestRegistry.digest()
+    """
+    return REGISTRY.digest(path, algo=algo, memo=memo)
+
+
+def copy_file(src, dst, algo=DEFAULT_ALGO):
+    """
+    copy file and remember its digest computed in the same pass
+
+    so that copied file isn't read again when cached or listed in
+    SHA256SUMS, see apkg.util.common.copy_file()
+
+    return hex digest of file contents
+    """
+    d = common.copy_file(src, dst, algo=algo)
+    REGISTRY.register(dst, d, algo=algo)
+    return d
+
+
+def write_checksums_files(paths):
+    """
+    write SHA256SUMS file listing regular files into each dir of paths
+
+    existing SHA256SUMS which is newer than listed files and lists
+    the same files is kept
+
+    return list of written SHA256SUMS paths
+    """
+    dirs = {}
+    for path in paths:
+        path = Path(path)
+        if path.is_file() and not path.is_symlink():
+            dirs.setdefault(path.parent, []).append(path)
+    written = []
+    for dir_path, files in sorted(dirs.items()):
+        sums_path = dir_path / CHECKSUMS_FN
+        files.sort()
+        if sums_path.exists():
+            mtime = sums_path.stat().st_mtime_ns
+            names = [line.split('  ', 1)[-1]
+                     for line in sums_path.open().read().splitlines()]
+            if (names == [f.name for f in files]
+                    and all(f.stat().st_mtime_ns <= mtime for f in files)):
+                continue
+        digests = file_digests(files, algo='sha256')
+        with atomic_write(sums_path) as f:
+            for path, d in zip(files, digests):
+                f.write('%s  %s\n' % (d, path.name))
+        log.verbose("written checksums: %s", sums_path)
+        written.append(sums_path)
+    return written
+
+
+def file_digests(paths, algo=DEFAULT_ALGO, memo=True):
+    """
+    return list of memoized hex digests of multiple files
+
+    files are hashed in parallel
+    """
+    return parallel_map(
+        lambda p: file_digest(p, algo=algo, memo=memo), paths)
+
+
+def parallel_map(fun, items):
+    """
+    map fun over items using a bounded thread pool
+
+    meant for I/O heavy functions such as hashing multiple files,
+    return list of results in the order of items
+    """
+    items = list(items)
+    if len(items) < 2:
+        return [fun(i) for i in items]
+    with ThreadPoolExecutor(min(len(items), MAX_WORKERS)) as pool:
+        return list(pool.map(fun, items))
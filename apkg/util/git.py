@@ -1,10 +1,182 @@
 # -*- encoding: utf-8 -*-
 import contextlib
 import os
+import re
+import tempfile
+import zlib
 
 from apkg import ex
 from apkg.util.run import run
 from apkg.util.run import ShellCommand
+import apkg.util.shutil35 as shutil
+
+
+def export_ignore_pathspecs(attrs_path):
+    """
+    return git pathspecs of files with export-ignore attribute
+
+    export-ignore files are excluded from git archive,
+    only patterns from specified .gitattributes file are considered
+    """
+    pathspecs = []
+    if not os.path.exists(str(attrs_path)):
+        return pathspecs
+    with open(str(attrs_path)) as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            pattern, *attrs = parts
+            if 'export-ignore' not in attrs:
+                continue
+            pattern = pattern.rstrip('/')
+            if '/' in pattern:
+                # anchored pattern relative to .gitattributes
+                pattern = pattern.lstrip('/')
+            else:
+                pattern = '**/%s' % pattern
+            # match files as well as contents of dirs
+            pathspecs.append(':(glob)%s' % pattern)
+            pathspecs.append(':(glob)%s/**' % pattern)
+    return pathspecs
+
+
+def exclude_pathspec(pathspec):
+    """
+    convert pathspec to exclude pathspec preserving its magic
+    """
+    if pathspec.startswith(':('):
+        return ':(exclude,%s' % pathspec[2:]
+    return ':(exclude)%s' % pathspec
+
+
+RE_SHA = re.compile(r'^[0-9a-f]{40,64}$')
+# max number of paths passed to a single git add
+ADD_CHUNK_SIZE = 1000
+
+
+def find_git_repo(path):
+    """
+    find git repo containing path without running git
+
+    walks up the directory tree like git does, .git files with
+    `gitdir: PATH` (used by worktrees and submodules) are followed
+
+    return (worktree top dir, git dir) tuple or (None, None) when
+    not in a git repo, top dir is None when GIT_DIR is set
+    """
+    env_git_dir = os.environ.get('GIT_DIR')
+    if env_git_dir:
+        if os.path.isdir(env_git_dir):
+            return None, os.path.abspath(env_git_dir)
+        return None, None
+    path = os.path.abspath(str(path))
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            if os.path.exists(os.path.join(dot_git, 'HEAD')):
+                return path, dot_git
+        elif os.path.isfile(dot_git):
+            with open(dot_git) as f:
+                line = f.readline().strip()
+            if line.startswith('gitdir:'):
+                git_dir = os.path.join(path, line[len('gitdir:'):].strip())
+                if os.path.isdir(git_dir):
+                    return path, os.path.normpath(git_dir)
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None, None
+        path = parent
+
+
+def find_git_dir(path):
+    """
+    find .git dir of repo containing path without running git
+
+    return path to git dir or None when not in a git repo
+    """
+    return find_git_repo(path)[1]
+
+
+def git_common_dir(git_dir):
+    """
+    return git dir shared by all worktrees (refs, objects)
+    """
+    common_path = os.path.join(git_dir, 'commondir')
+    if not os.path.exists(common_path):
+        return git_dir
+    with open(common_path) as f:
+        return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+
+def resolve_ref(git_dir, ref='HEAD'):
+    """
+    resolve git ref to commit hash without running git
+
+    loose refs and packed-refs are supported
+
+    return commit hash or None when ref doesn't exist
+    """
+    common_dir = git_common_dir(git_dir)
+    # limit depth of symbolic refs
+    for _ in range(8):
+        value = None
+        # HEAD and other pseudo refs are per-worktree
+        for d in [git_dir, common_dir]:
+            ref_path = os.path.join(d, ref)
+            if os.path.isfile(ref_path):
+                with open(ref_path) as f:
+                    value = f.read().strip()
+                break
+        if value is None:
+            return packed_ref(common_dir, ref)
+        if value.startswith('ref:'):
+            ref = value[len('ref:'):].strip()
+            continue
+        if RE_SHA.match(value):
+            return value
+        return None
+    return None
+
+
+def packed_ref(common_dir, ref):
+    """
+    look up ref in packed-refs file
+    """
+    packed_path = os.path.join(common_dir, 'packed-refs')
+    if not os.path.exists(packed_path):
+        return None
+    with open(packed_path) as f:
+        for line in f:
+            if line.startswith('#') or line.startswith('^'):
+                continue
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    return None
+
+
+def commit_tree(git_dir, commit):
+    """
+    return tree hash of a loose commit object without running git
+
+    return None when commit isn't available as a loose object
+    (such as in a pack) so that caller can fall back to git
+    """
+    obj_path = os.path.join(
+        git_common_dir(git_dir), 'objects', commit[:2], commit[2:])
+    try:
+        with open(obj_path, 'rb') as f:
+            data = zlib.decompress(f.read())
+    except (OSError, zlib.error):
+        return None
+    header, _, body = data.partition(b'\0')
+    if not header.startswith(b'commit '):
+        return None
+    line = body.split(b'\n', 1)[0]
+    if not line.startswith(b'tree '):
+        return None
+    return line[len(b'tree '):].decode('ascii')
 
 
 @contextlib.contextmanager
@@ -263,6 +435,61 @@ class Git(ShellCommand):
         self('rebase', '--onto', ref + '^', ref, '--preserve-merges',
              '--committer-date-is-author-date')
 
+    def worktree_tree(self, paths=None, excludes=None, index_path=None):
+        """
+        return git tree id of current working tree state
+
+        Tracked files are included with their working tree changes
+        as well as untracked files which aren't ignored.
+
+        Tree is written using a temporary copy of index so that the real
+        index isn't modified. Git reuses stat info from index so only
+        changed files are read and nothing is loaded into python memory.
+
+        Args:
+            paths: only include these pathspecs (default: whole repo)
+            excludes: exclude these pathspecs
+            index_path: path to git index (default: ask git)
+        """
+        excludes = excludes or []
+        if not index_path:
+            index_path = self(
+                'rev-parse', '--git-path', 'index', log_cmd=False)
+        with tempfile.TemporaryDirectory(prefix='apkg_git_') as tmpdir:
+            tmp_index = os.path.join(tmpdir, 'index')
+            if os.path.exists(index_path):
+                shutil.copyfile(index_path, tmp_index)
+            env = os.environ.copy()
+            env['GIT_INDEX_FILE'] = tmp_index
+            # --force: staged changes don't matter in throwaway index
+            rm = ['rm', '--cached', '-r', '-q', '--force',
+                  '--ignore-unmatch', '--']
+            if paths:
+                # drop tracked files outside of paths
+                self(*rm + [':/'] + [exclude_pathspec(p) for p in paths],
+                     env=env, log_cmd=False)
+            pathspecs = list(paths or [':/'])
+            pathspecs += [exclude_pathspec(p) for p in excludes]
+            # update tracked files
+            self('add', '--update', '--', *pathspecs,
+                 env=env, log_cmd=False)
+            # add untracked files listed explicitly because add --all
+            # fails on excluded paths which are also ignored and
+            # without excludes it would hash and store output files
+            untracked = self('ls-files', '-z', '--others',
+                             '--exclude-standard', '--', *pathspecs,
+                             env=env, log_cmd=False)
+            untracked = [f for f in untracked.split('\0') if f]
+            env['GIT_LITERAL_PATHSPECS'] = '1'
+            for i in range(0, len(untracked), ADD_CHUNK_SIZE):
+                self('add', '--', *untracked[i:i + ADD_CHUNK_SIZE],
+                     env=env, log_cmd=False)
+            del env['GIT_LITERAL_PATHSPECS']
+            if excludes:
+                # drop tracked files in excludes
+                self(*rm + excludes, env=env, log_cmd=False)
+            return self('write-tree', env=env, log_cmd=False)
+
     def get_timestamp_by_ref(self, ref):
         timestamp = self('show', '-s', '--oneline', '--format="%ct"',
                          ref, log_cmd=False)
@@ -20,6 +20,14 @@ def copy(src, dst, **kwargs):
     return shutil.copy(str(src), str(dst), **kwargs)
 
 
+def copyfileobj(fsrc, fdst, **kwargs):
+    return shutil.copyfileobj(fsrc, fdst, **kwargs)
+
+
+def copymode(src, dst, **kwargs):
+    return shutil.copymode(str(src), str(dst), **kwargs)
+
+
 def copyfile(src, dst, **kwargs):
     return shutil.copyfile(str(src), str(dst), **kwargs)
 
@@ -0,0 +1,214 @@
+"""
+VCS-independent content hash of a project tree
+
+Tree hash is a merkle hash computed over all files in project tree
+except ignored ones, similar to git tree object hash:
+
+* file hash covers file contents and executable bit
+* symlink hash covers link target
+* directory hash covers sorted names, types and hashes of its entries
+
+Ignore rules from `.gitignore` files are respected (common subset of
+the syntax: negation, directory-only and anchored patterns) and VCS
+metadata dirs are always ignored.
+
+Hashes of files are memoized by file stat (size, mtime, inode, device)
+in a JSON file so that only modified files need to be read on repeat
+runs.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+from pathlib import Path
+import stat
+import time
+
+from apkg.log import getLogger
+from apkg.util.common import atomic_write
+from apkg.util.digest import file_digest, INTERNAL_ALGO, RACY_NS
+
+
+log = getLogger(__name__)
+
+
+# always ignored names
+IGNORED_NAMES = {'.git', '.hg', '.svn', '.bzr'}
+IGNORE_FN = '.gitignore'
+
+
+class IgnoreRule:
+    """
+    single .gitignore pattern
+    """
+    def __init__(self, base, pattern):
+        self.base = base
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if pattern.startswith('**/'):
+            pattern = pattern[3:]
+        # patterns containing / are relative to .gitignore location
+        self.anchored = '/' in pattern
+        self.pattern = pattern.lstrip('/').replace('/**/', '/*')
+
+    def match(self, relpath, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            if self.base:
+                if not relpath.startswith(self.base + '/'):
+                    return False
+                relpath = relpath[len(self.base) + 1:]
+            return fnmatch.fnmatchcase(relpath, self.pattern)
+        return fnmatch.fnmatchcase(relpath.rpartition('/')[2], self.pattern)
+
+
+def load_ignore_rules(path, base):
+    """
+    load IgnoreRule list from .gitignore in path if it exists
+    """
+    rules = []
+    ignore_path = path / IGNORE_FN
+    if not ignore_path.exists():
+        return rules
+    for line in ignore_path.open(encoding='utf-8', errors='replace'):
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#'):
+            continue
+        rules.append(IgnoreRule(base, line))
+    return rules
+
+
+def is_ignored(rules, relpath, is_dir):
+    ignored = False
+    for rule in rules:
+        if rule.negate == ignored and rule.match(relpath, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+class TreeHasher:
+    """
+    compute merkle hash of a directory tree with memoized file hashes
+    """
+    def __init__(self, path, include=None, exclude=None, memo_path=None):
+        """
+        Args:
+            path: root of the tree to hash
+            include: only include these paths relative to root
+            exclude: paths to exclude such as project output dir
+            memo_path: JSON file to persist memoized file hashes in
+        """
+        self.path = Path(path)
+        self.include = [str(Path(p)) for p in include or []]
+        self.exclude = {os.path.abspath(str(p)) for p in exclude or []}
+        self.memo_path = memo_path
+        self.memo = {}
+        self.new_memo = {}
+        self.hashed = 0
+
+    def load_memo(self):
+        if not (self.memo_path and self.memo_path.exists()):
+            return
+        try:
+            self.memo = json.load(self.memo_path.open())
+        except (OSError, ValueError) as e:
+            log.verbose("ignoring invalid tree hash memo %s: %s",
+                        self.memo_path, e)
+
+    def save_memo(self):
+        if not self.memo_path or self.new_memo == self.memo:
+            return
+        try:
+            self.memo_path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_write(self.memo_path) as f:
+                json.dump(self.new_memo, f)
+        except OSError as e:
+            log.verbose("unable to save tree hash memo %s: %s",
+                        self.memo_path, e)
+
+    def file_hash(self, path, relpath, st):
+        fp = [st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev]
+        memo = self.memo.get(relpath)
+        if memo and memo[:4] == fp:
+            digest = memo[4]
+        else:
+            digest = file_digest(path, algo=INTERNAL_ALGO)
+            self.hashed += 1
+        # NOTE(py35): use time.time_ns() when py3.5 support is dropped
+        if int(time.time() * 10**9) - st.st_mtime_ns > RACY_NS:
+            self.new_memo[relpath] = fp + [digest]
+        return digest
+
+    def is_included(self, relpath, is_dir):
+        """
+        tell if relpath is included or is a dir containing included paths
+        """
+        if not self.include:
+            return True
+        for inc in self.include:
+            if relpath == inc or relpath.startswith(inc + '/'):
+                return True
+            if is_dir and inc.startswith(relpath + '/'):
+                return True
+        return False
+
+    def dir_hash(self, path, relpath, rules):
+        rules = rules + load_ignore_rules(path, relpath)
+        h = hashlib.new(INTERNAL_ALGO)
+        for entry in sorted(os.scandir(str(path)), key=lambda e: e.name):
+            if entry.name in IGNORED_NAMES:
+                continue
+            epath = path / entry.name
+            if os.path.abspath(str(epath)) in self.exclude:
+                continue
+            erelpath = '%s/%s' % (relpath, entry.name) if relpath \
+                else entry.name
+            st = entry.stat(follow_symlinks=False)
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if is_ignored(rules, erelpath, is_dir):
+                continue
+            if not self.is_included(erelpath, is_dir):
+                continue
+            if is_dir:
+                etype = 'tree'
+                digest = self.dir_hash(epath, erelpath, rules)
+            elif stat.S_ISLNK(st.st_mode):
+                etype = 'link'
+                digest = hashlib.new(INTERNAL_ALGO, os.readlink(
+                    str(epath)).encode('utf-8', 'surrogateescape')
+                ).hexdigest()
+            elif stat.S_ISREG(st.st_mode):
+                etype = 'exec' if st.st_mode & stat.S_IXUSR else 'file'
+                digest = self.file_hash(epath, erelpath, st)
+            else:
+                continue
+            h.update(('%s %s\0%s\n' % (
+                etype, entry.name, digest)).encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def hash(self):
+        """
+        return hex digest of the tree
+        """
+        self.load_memo()
+        self.new_memo = {}
+        self.hashed = 0
+        digest = self.dir_hash(self.path, '', [])
+        log.verbose("tree hash of %s: %s (%d files hashed)",
+                    self.path, digest, self.hashed)
+        self.save_memo()
+        return digest
+
+
+def tree_hash(path, include=None, exclude=None, memo_path=None):
+    """
+    return merkle hash of a directory tree respecting .gitignore files
+
+    see TreeHasher for details
+    """
+    return TreeHasher(path, include=include, exclude=exclude,
+                      memo_path=memo_path).hash()
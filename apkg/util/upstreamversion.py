@@ -1,12 +1,15 @@
 # -*- encoding: utf-8 -*-
 
+import json
 import re
+import time
 
 import bs4
 from packaging import version
 import requests
 
 from apkg.log import getLogger
+from apkg.util.common import atomic_write
 from apkg.util.run import run
 
 
@@ -14,18 +17,111 @@ log = getLogger(__name__)
 
 
 RE_ARCHIVE_VERSION = r'[\w-]+-(\d[^-]+)\.tar\..*'
+# default time in seconds to trust cached upstream version
+DEFAULT_CACHE_TTL = 3600
 
 
-def version_from_listing(html_listing_url):
+class VersionCache:
+    """
+    persistent cache of detected upstream versions
+
+    entries are keyed by version source (listing URL or script) and hold
+    detected version, time of last check and HTTP validators
+    (ETag, Last-Modified) used to revalidate listings cheaply
+    """
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = None
+
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not self.path.exists():
+            return
+        try:
+            self.entries = json.load(self.path.open())
+        except (OSError, ValueError) as e:
+            log.verbose("ignoring invalid upstream version cache %s: %s",
+                        self.path, e)
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_write(self.path) as f:
+                json.dump(self.entries, f, indent=4)
+        except OSError as e:
+            log.verbose("unable to save upstream version cache %s: %s",
+                        self.path, e)
+
+    def get(self, key):
+        self.load()
+        return self.entries.get(key)
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get('checked', 0) < self.ttl
+
+    def update(self, key, entry):
+        self.load()
+        entry['checked'] = time.time()
+        self.entries[key] = entry
+        self.save()
+
+
+def parse_entry_version(entry):
+    v = entry.get('version')
+    if v is None:
+        return None
+    return version.parse(v)
+
+
+def version_from_listing(html_listing_url, cache=None, refresh=False):
     """
     get latest version from HTML listing
+
+    When VersionCache is supplied, cached version is used while fresh
+    and listing is then revalidated using conditional request.
+    refresh ignores cached version.
     """
+    entry = None
+    if cache and not refresh:
+        entry = cache.get(html_listing_url)
+        if entry and cache.is_fresh(entry):
+            v = parse_entry_version(entry)
+            log.verbose("using cached upstream version from %s: %s",
+                        html_listing_url, v)
+            return v
     log.verbose("getting upstream version from HTML listing: %s",
                 html_listing_url)
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    r = requests.get(html_listing_url, headers=headers)
+    if entry and r.status_code == 304:
+        log.verbose("HTML listing not modified: %s", html_listing_url)
+        cache.update(html_listing_url, entry)
+        return parse_entry_version(entry)
+    v = version_from_html(r.content)
+    if cache and r.ok:
+        cache.update(html_listing_url, {
+            'version': str(v) if v else None,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+        })
+    return v
+
+
+def version_from_html(html):
+    """
+    get latest version from HTML listing content
+    """
     found = False
     v_max = version.parse('0')
-    r = requests.get(html_listing_url)
-    soup = bs4.BeautifulSoup(r.content, 'html.parser')
+    soup = bs4.BeautifulSoup(html, 'html.parser')
     for a in soup.find_all('a'):
         m = re.match(RE_ARCHIVE_VERSION, a.string)
         if not m:
@@ -38,12 +134,26 @@ def version_from_listing(html_listing_url):
     return None
 
 
-def version_from_script(script, script_name='script'):
+def version_from_script(script, script_name='script',
+                        cache=None, refresh=False):
     """
     get version from last stdout line of a script
+
+    When VersionCache is supplied, cached version is used while fresh
+    unless refresh is requested.
     """
+    key = 'script:%s' % script
+    if cache and not refresh:
+        entry = cache.get(key)
+        if entry and cache.is_fresh(entry):
+            v = parse_entry_version(entry)
+            log.verbose("using cached upstream version from %s: %s",
+                        script_name, v)
+            return v
     log.verbose("getting upstream version from %s: %s", script_name, script)
     out = run(script)
     _, _, last_line = out.rpartition('\n')
     v = version.parse(last_line.strip())
+    if cache:
+        cache.update(key, {'version': str(v)})
     return v
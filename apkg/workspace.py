@@ -0,0 +1,126 @@
+"""
+apkg workspace of multiple projects (such as monorepo components)
+
+Workspace is a directory containing multiple apkg projects (dirs with
+their own distro/ input dir) anywhere in its tree.
+
+apkg commands are run for all workspace projects in a pool of worker
+processes so python startup and apkg import is only paid once.
+Cached files of all projects share one content-addressable store
+in workspace output dir (pkg/.store) so identical artifacts are only
+stored once and projects which didn't change reuse their cached results.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import importlib
+import os
+from pathlib import Path
+
+from apkg import cache as _cache
+from apkg import ex
+from apkg.log import getLogger
+from apkg.project import CONFIG_FN, INPUT_BASE_DIR, OUTPUT_BASE_DIR
+
+
+log = getLogger(__name__)
+
+
+# dirs never searched for projects
+SKIP_DIRS = {INPUT_BASE_DIR, OUTPUT_BASE_DIR, 'node_modules'}
+# apkg commands supported in workspace: name -> module or function
+WORKSPACE_COMMANDS = {
+    'srcpkg': 'apkg.commands.srcpkg',
+    'build': 'apkg.commands.build',
+}
+
+
+def is_project_dir(path):
+    """
+    tell if path is apkg project root
+    """
+    input_path = path / INPUT_BASE_DIR
+    return ((input_path / 'config' / CONFIG_FN).exists()
+            or (input_path / 'pkg').is_dir())
+
+
+def discover_projects(path):
+    """
+    return sorted list of apkg project paths found under path
+    """
+    projects = []
+    for d, dirs, _ in os.walk(str(path)):
+        if is_project_dir(Path(d)):
+            projects.append(Path(d))
+        # don't descend into hidden, input and output dirs
+        dirs[:] = [x for x in dirs
+                   if not x.startswith('.') and x not in SKIP_DIRS]
+    return sorted(projects)
+
+
+def get_command(name):
+    """
+    return function implementing apkg command supported in workspace
+    """
+    cmd = WORKSPACE_COMMANDS[name]
+    if callable(cmd):
+        return cmd
+    # commands are imported lazily as they import apkg.cli
+    module = importlib.import_module(cmd)
+    return getattr(module, name)
+
+
+def run_project_command(path, command, kwargs, store_path=None):
+    """
+    run apkg command in project path
+
+    this runs in worker process
+
+    return (list of result paths, error message or None)
+    """
+    os.chdir(str(path))
+    if store_path:
+        os.environ[_cache.STORE_ENV_VAR] = str(store_path)
+    fun = get_command(command)
+    results = []
+    error = None
+    try:
+        results = [str(path / r) for r in fun(**kwargs)]
+    except ex.ApkgException as e:
+        error = str(e)
+    except Exception as e:
+        # unexpected error in one project shouldn't abort others
+        error = "unexpected error: %s: %s" % (type(e).__name__, e)
+    finally:
+        # worker processes don't run atexit handlers
+        _cache.flush_all()
+    return results, error
+
+
+def run_workspace_command(path, command, jobs=None, share_store=True,
+                          **kwargs):
+    """
+    run apkg command for all projects in workspace path
+
+    Args:
+        path: workspace path
+        command: name of apkg command such as build
+        jobs: number of worker processes (default: CPU count)
+        share_store: use shared cache store in workspace output dir
+        kwargs: arguments passed to command
+
+    return list of (project path, results, error) tuples
+    """
+    path = Path(path).resolve()
+    projects = discover_projects(path)
+    if not projects:
+        raise ex.InvalidInput(fail="no apkg projects found in: %s" % path)
+    log.info("found %d projects in workspace: %s", len(projects), path)
+    store_path = None
+    if share_store:
+        store_path = path / OUTPUT_BASE_DIR / '.store'
+        log.verbose("shared cache store: %s", store_path)
+    jobs = min(jobs or os.cpu_count() or 1, len(projects))
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(run_project_command, p, command, kwargs,
+                               store_path=store_path)
+                   for p in projects]
+        return [(p,) + f.result() for p, f in zip(projects, futures)]
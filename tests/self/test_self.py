@@ -27,6 +27,7 @@ def test_import_command_modules():
     """
     import apkg.commands.build  # noqa
     import apkg.commands.build_dep  # noqa
+    import apkg.commands.cache  # noqa
     import apkg.commands.get_archive  # noqa
     import apkg.commands.install  # noqa
     import apkg.commands.make_archive  # noqa
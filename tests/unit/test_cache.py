@@ -0,0 +1,480 @@
+from pathlib import Path
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+import pytest
+
+from apkg import cache as _cache
+from apkg import cachebundle
+from apkg import cachestore
+from apkg import ex
+from apkg.parse import parse_size
+from apkg.project import Project
+from apkg.util import common
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+@pytest.fixture(params=['json', 'sqlite'])
+def proj(tmpdir, request):
+    path = Path(str(tmpdir))
+    config_path = path / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True)
+    config_path.open('w').write(
+        '[cache]\nbackend = "%s"\nstore = true\n' % request.param)
+    p = Project(path=path)
+    p.output_path.mkdir(parents=True)
+    return p
+
+
+@pytest.fixture
+def checksum_calls(monkeypatch):
+    calls = []
+    orig_file_checksum = _cache.file_checksum
+
+    def file_checksum(path, **kwargs):
+        calls.append(path)
+        return orig_file_checksum(path, **kwargs)
+
+    monkeypatch.setattr(_cache, 'file_checksum', file_checksum)
+    return calls
+
+
+def make_file(proj, name, content='foo'):
+    path = proj.output_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.open('w').write(content)
+    return path
+
+
+def test_cache_fingerprint_skips_hashing(proj, checksum_calls):
+    path = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [path])
+    del checksum_calls[:]
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert checksum_calls == []
+
+
+def test_cache_paranoid_hashes(proj, checksum_calls):
+    path = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [path])
+    del checksum_calls[:]
+    proj.cache.enabled(paranoid=True)
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert checksum_calls == [path]
+
+
+def test_cache_touched_file_revalidated(proj, checksum_calls):
+    path = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [path])
+    st = path.stat()
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    del checksum_calls[:]
+    # same content -> valid and fingerprint refreshed
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert checksum_calls == [path]
+    del checksum_calls[:]
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert checksum_calls == []
+
+
+def test_cache_modified_file_invalid(proj):
+    path = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [path])
+    make_file(proj, 'a.tar.gz', content='foobar')
+    assert proj.cache.get('archive/dev', 'k1') is None
+
+
+def test_cache_legacy_entry(proj, checksum_calls):
+    path = make_file(proj, 'a.tar.gz')
+    # cache entry without fingerprint as created by older apkg
+    legacy = {'archive/dev': {'k1': [[str(path), _cache.file_checksum(path)]]}}
+    proj.cache_path.open('w').write(json.dumps(legacy))
+    del checksum_calls[:]
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert checksum_calls == [path]
+    del checksum_calls[:]
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert checksum_calls == []
+
+
+def test_cache_flush_batches_writes(proj):
+    a = make_file(proj, 'a.tar.gz')
+    b = make_file(proj, 'b.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [a])
+    proj.cache.update('archive/dev', 'k2', [b])
+    assert Project(path=proj.path).cache.get('archive/dev', 'k2') is None
+    _cache.flush_all()
+    # no temporary files left behind
+    assert not list(proj.output_path.glob('*.tmp'))
+    loaded = Project(path=proj.path)
+    assert loaded.cache.get('archive/dev', 'k1') == [a]
+    assert loaded.cache.get('archive/dev', 'k2') == [b]
+
+
+def test_cache_corrupted_ignored(proj):
+    if proj.cache.new_backend().name != 'json':
+        pytest.skip("JSON cache only")
+    proj.cache_path.open('w').write('{"archive/dev": {"k1": [')
+    assert proj.cache.get('archive/dev', 'k1') is None
+
+
+def test_cache_merge_concurrent_writers(proj):
+    a = make_file(proj, 'a.tar.gz')
+    b = make_file(proj, 'b.tar.gz')
+    # two processes loaded the same (empty) cache
+    other = Project(path=proj.path)
+    proj.cache.get('pkg/debian-11', 'k1')
+    other.cache.get('pkg/fedora-34', 'k2')
+    proj.cache.update('pkg/debian-11', 'k1', [a])
+    other.cache.update('pkg/fedora-34', 'k2', [b])
+    proj.cache.flush()
+    other.cache.flush()
+    # neither entry was lost
+    loaded = Project(path=proj.path)
+    assert loaded.cache.get('pkg/debian-11', 'k1') == [a]
+    assert loaded.cache.get('pkg/fedora-34', 'k2') == [b]
+
+
+def test_cache_sqlite_migrates_json(proj):
+    if proj.cache.new_backend().name != 'sqlite':
+        pytest.skip("SQLite cache only")
+    path = make_file(proj, 'a.tar.gz')
+    jbackend = _cache.JSONCacheBackend(proj.cache_path)
+    jbackend.commit({('archive/dev', 'k1'): [_cache.path2entry(path)]})
+    assert not proj.cache_db_path.exists()
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    assert proj.cache_db_path.exists()
+
+
+def test_cache_store_dedup_and_restore(proj):
+    a = make_file(proj, 'a.tar.gz')
+    b = make_file(proj, 'b.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [a])
+    proj.cache.update('archive/upstream', 'k2', [b])
+    # identical files are stored only once
+    assert len(list(proj.cache.store.checksums())) == 1
+    a.unlink()
+    assert proj.cache.get('archive/dev', 'k1') == [a]
+    assert a.open().read() == 'foo'
+    assert a.stat().st_ino != b.stat().st_ino
+
+
+def test_cache_store_default(tmpdir, monkeypatch):
+    path = Path(str(tmpdir))
+
+    def no_reflink(src, dst):
+        raise OSError("reflink not supported")
+
+    # store would only duplicate cached files without reflinks
+    monkeypatch.setattr(cachestore, 'reflink_file', no_reflink)
+    assert Project(path=path).cache.store is None
+    monkeypatch.setattr(cachestore, 'reflink_file', common.copy_file)
+    assert Project(path=path).cache.store is not None
+    assert not list(path.glob('pkg/.reflink-probe-*'))
+
+
+def test_cache_store_corrupted_object(proj):
+    a = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [a])
+    checksum, = proj.cache.store.checksums()
+    obj = proj.cache.store.object_path(checksum)
+    # same size, different content
+    obj.open('w').write('bar')
+    proj.cache.store.add(a, checksum)
+    assert obj.open().read() == 'foo'
+
+
+def test_cache_store_output_overwritten_in_place(proj):
+    a = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [a])
+    result_dir = proj.path / 'out'
+    paths = common.get_cached_paths(proj, 'archive/dev', 'k1', result_dir)
+    assert paths == [result_dir / 'a.tar.gz']
+    # tool overwriting its output in place doesn't affect store or exports
+    a.open('w').write('bar')
+    assert paths[0].open().read() == 'foo'
+    checksum, = proj.cache.store.checksums()
+    assert proj.cache.store.object_path(checksum).open().read() == 'foo'
+    a.unlink()
+    assert proj.cache.get('archive/dev', 'k1') == [a]
+    assert a.open().read() == 'foo'
+
+
+def test_cache_store_detach_hardlink(proj):
+    a = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [a])
+    checksum, = proj.cache.store.checksums()
+    obj = proj.cache.store.object_path(checksum)
+    # output hardlinked to store by older apkg is detached
+    a.unlink()
+    os.link(str(obj), str(a))
+    proj.cache.update('archive/dev', 'k1', [a])
+    assert a.stat().st_ino != obj.stat().st_ino
+    assert a.open().read() == 'foo'
+
+
+def test_build_shortcut_build_dep(proj, monkeypatch):
+    # commands must be imported through apkg.cli
+    import apkg.cli  # noqa: F401
+    from apkg.commands import build
+    deps_calls = []
+    monkeypatch.setattr(build, 'cmd_build_dep',
+                        lambda **kwargs: deps_calls.append(kwargs))
+    path = make_file(proj, 'pkgs/foo.deb')
+    proj.cache.update('build/debian-12', '%s:' % proj.checksum, [path])
+    # build deps are installed even on cache hit
+    assert build.build(distro='debian-12', build_dep=True,
+                       project=proj) == [path]
+    assert len(deps_calls) == 1
+
+
+def test_cache_hit_doesnt_write(proj, monkeypatch):
+    path = make_file(proj, 'a.tar.gz')
+    proj.cache.update('archive/dev', 'k1', [path])
+    proj.cache.flush()
+    # recently accessed entry
+    loaded = Project(path=proj.path)
+    assert loaded.cache.get('archive/dev', 'k1') == [path]
+    assert not loaded.cache.dirty
+    # entry not accessed for a long time
+    monkeypatch.setattr(_cache, 'ACCESS_RESOLUTION', 0)
+    loaded = Project(path=proj.path)
+    assert loaded.cache.get('archive/dev', 'k1') == [path]
+    assert loaded.cache.dirty
+
+
+def test_cache_gc_lru(proj):
+    paths = []
+    for i, key in enumerate(['k1', 'k2', 'k3']):
+        content = 'x' * 100 * (i + 1)
+        path = make_file(proj, 'pkgs/%s.deb' % key, content=content)
+        proj.cache.update('pkg/debian-11', key, [path])
+        proj.cache.accessed[('pkg/debian-11', key)] = 1000 + i
+        paths.append(path)
+    proj.cache.flush()
+    # k1 is least recently used and evicting it is enough
+    assert cachestore.gc(proj.cache, max_size=550, dry_run=True) == [
+        ('pkg/debian-11', 'k1')]
+    assert paths[0].exists()
+    # access k1 so that k2 becomes least recently used
+    assert proj.cache.get('pkg/debian-11', 'k1') == [paths[0]]
+    assert cachestore.gc(proj.cache, max_size=550) == [('pkg/debian-11', 'k2')]
+    assert not paths[1].exists()
+    assert len(list(proj.cache.store.checksums())) == 2
+    loaded = Project(path=proj.path)
+    assert loaded.cache.get('pkg/debian-11', 'k2') is None
+    assert loaded.cache.get('pkg/debian-11', 'k3') == [paths[2]]
+    # max_age evicts everything not accessed recently
+    assert sorted(cachestore.gc(proj.cache, max_age=0)) == [
+        ('pkg/debian-11', 'k1'), ('pkg/debian-11', 'k3')]
+    assert not list(proj.cache.store.checksums())
+    assert not (proj.output_path / 'pkgs').exists()
+
+
+def test_parse_size():
+    assert parse_size(None) is None
+    assert parse_size(42) == 42
+    assert parse_size('512') == 512
+    assert parse_size('2K') == 2048
+    assert parse_size('1.5 GiB') == 1536 * 1024 ** 2
+    with pytest.raises(ex.InvalidInput):
+        parse_size('lots')
+
+
+def test_cache_stats(proj):
+    path = make_file(proj, 'a.tar.gz')
+    assert proj.cache.get('archive/dev', 'k1') is None
+    proj.cache.update('archive/dev', 'k1', [path])
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    proj.cache.enabled(paranoid=True)
+    assert proj.cache.get('archive/dev', 'k1') == [path]
+    _cache.flush_all()
+    runs = proj.cache.stats.load_runs()
+    assert len(runs) == 1
+    stats = _cache.sum_stats(runs)['archive/dev']
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['builds'] == 1
+    assert stats['bytes_verified'] == 3
+
+
+def test_cache_export_import_bundle(proj, tmpdir):
+    a = make_file(proj, 'archives/dev/foo-1.0.tar.gz')
+    b = make_file(proj, 'pkgs/foo.deb', content='deb')
+    proj.cache.update('archive/dev', 'k1', [a])
+    proj.cache.update('pkg/debian-11', 'k2', [b])
+    bundle = Path(str(tmpdir)) / 'bundle.tar.gz'
+    exported = cachebundle.export_bundle(
+        proj.cache, bundle, cache_names=['archive/*'])
+    assert exported == [('archive/dev', 'k1')]
+    # import into another checkout of the project
+    path = Path(str(tmpdir)) / 'checkout2'
+    config_path = path / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True)
+    config_path.write_bytes(proj.config_path.read_bytes())
+    proj2 = Project(path=path)
+    imported = cachebundle.import_bundle(proj2.cache, bundle)
+    assert imported == [('archive/dev', 'k1')]
+    a2 = proj2.output_path / 'archives' / 'dev' / 'foo-1.0.tar.gz'
+    assert proj2.cache.get('archive/dev', 'k1') == [a2]
+    assert a2.open().read() == 'foo'
+    assert proj2.cache.get('pkg/debian-11', 'k2') is None
+
+
+def make_bundle(path, manifest, objects):
+    with tarfile.open(str(path), 'w:gz') as tar:
+        files = dict(objects)
+        files['manifest.json'] = json.dumps(manifest).encode('utf-8')
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_cache_import_invalid_bundle(proj, tmpdir):
+    bundle = Path(str(tmpdir)) / 'bundle.tar.gz'
+    make_bundle(bundle, {'project': 'foo'}, {})
+    with pytest.raises(ex.InvalidFormat):
+        cachebundle.import_bundle(proj.cache, bundle)
+    a = make_file(proj, 'archives/dev/foo-1.0.tar.gz')
+    checksum = _cache.file_checksum(a)
+    a.unlink()
+    entry = {'cache_name': 'archive/dev', 'key': 'k1',
+             'files': [['pkg/archives/dev/foo-1.0.tar.gz', checksum]]}
+    manifest = {'project': 'foo', 'entries': [entry]}
+    # object missing from bundle
+    make_bundle(bundle, manifest, {})
+    with pytest.raises(ex.InvalidFormat):
+        cachebundle.import_bundle(proj.cache, bundle)
+    # corrupted object doesn't replace existing file
+    a.open('w').write('old')
+    make_bundle(bundle, manifest, {'objects/%s' % checksum: b'bad'})
+    with pytest.raises(ex.InvalidFormat):
+        cachebundle.import_bundle(proj.cache, bundle)
+    assert a.open().read() == 'old'
+    assert not list(a.parent.glob('.*.tmp'))
+    # nothing is imported when a later entry is invalid
+    a.unlink()
+    entry2 = {'cache_name': 'archive/dev', 'key': 'k2',
+              'files': [['pkg/archives/dev/foo-2.0.tar.gz', '0123']]}
+    manifest['entries'].append(entry2)
+    make_bundle(bundle, manifest, {'objects/%s' % checksum: b'foo'})
+    with pytest.raises(ex.InvalidFormat):
+        cachebundle.import_bundle(proj.cache, bundle)
+    assert not a.exists()
+    assert proj.cache.get('archive/dev', 'k1') is None
+    assert not list(proj.cache.store.checksums())
+    assert not list(proj.output_path.glob('.bundle-import-*'))
+    # invalid checksum can't be used to escape staging dir
+    entry2['files'][0][1] = '../../escape'
+    make_bundle(bundle, manifest, {'objects/%s' % checksum: b'foo'})
+    with pytest.raises(ex.InvalidFormat):
+        cachebundle.import_bundle(proj.cache, bundle)
+
+
+def test_cache_single_flight_wait(proj, monkeypatch):
+    monkeypatch.setattr(_cache.InFlightLock, 'POLL', 0.05)
+    backends = []
+    orig_new_backend = proj.cache.new_backend
+
+    def new_backend():
+        backends.append(orig_new_backend())
+        return backends[-1]
+
+    monkeypatch.setattr(proj.cache, 'new_backend', new_backend)
+    path = make_file(proj, 'a.tar.gz')
+    # another process misses first and starts creating the entry
+    other = Project(path=proj.path)
+    assert other.cache.get('archive/dev', 'k1') is None
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+        proj.cache.get('archive/dev', 'k1')))
+    thread.start()
+    time.sleep(0.3)
+    other.cache.update('archive/dev', 'k1', [path])
+    thread.join(timeout=10)
+    assert results == [[path]]
+    assert proj.cache.stats.counters['archive/dev']['shared_hits'] == 1
+    assert not proj.cache.in_flight
+    assert not other.cache.in_flight
+    # backend used to load entry of the other process is closed
+    assert len(backends) == 2
+    assert getattr(backends[1], 'conn', None) is None
+
+
+def test_cache_single_flight_takeover(proj, monkeypatch):
+    monkeypatch.setattr(_cache.InFlightLock, 'POLL', 0.05)
+    other = Project(path=proj.path)
+    assert other.cache.get('archive/dev', 'k1') is None
+    lock = other.cache.in_flight[('archive/dev', 'k1')]
+    # owner stopped sending heartbeats
+    lock._stop.set()
+    os.utime(str(lock.path), (1000000000, 1000000000))
+    assert proj.cache.get('archive/dev', 'k1') is None
+    assert ('archive/dev', 'k1') in proj.cache.in_flight
+    proj.cache.release_in_flight()
+    other.cache.release_in_flight()
+
+
+def test_cache_single_flight_same_thread(proj):
+    # two cache objects of the same project in one thread must not deadlock
+    other = Project(path=proj.path)
+    assert other.cache.get('archive/dev', 'k1') is None
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+        Project(path=proj.path).cache.get('archive/dev', 'k1')))
+    # lock held by a different thread is waited for
+    thread.start()
+    thread.join(timeout=0.3)
+    assert thread.is_alive()
+    assert proj.cache.get('archive/dev', 'k1') is None
+    assert ('archive/dev', 'k1') not in proj.cache.in_flight
+    other.cache.release_in_flight()
+    thread.join(timeout=10)
+    assert results == [None]
+
+
+def test_cache_dir_and_symlink(proj, tmpdir):
+    target = Path(str(tmpdir)) / 'nix' / 'store' / 'abc-foo-1.0'
+    target.mkdir(parents=True)
+    link = proj.output_path / 'pkgs' / 'result'
+    link.parent.mkdir(parents=True)
+    link.symlink_to(target)
+    result = proj.output_path / 'pkgs' / 'foo-1.0'
+    make_file(proj, 'pkgs/foo-1.0/bin/foo')
+    proj.cache.update('pkg/nix', 'k1', [link, result])
+    assert proj.cache.get('pkg/nix', 'k1') == [link, result]
+    # copy into result dir
+    result_dir = proj.path / 'out'
+    paths = common.get_cached_paths(proj, 'pkg/nix', 'k1', result_dir)
+    assert paths == [result_dir / 'result', result_dir / 'foo-1.0']
+    assert os.readlink(str(paths[0])) == str(target)
+    assert (paths[1] / 'bin' / 'foo').open().read() == 'foo'
+    # modified dir contents invalidate entry
+    make_file(proj, 'pkgs/foo-1.0/bin/foo', content='bar')
+    assert proj.cache.get('pkg/nix', 'k1') is None
+    # changed symlink target invalidates entry
+    proj.cache.update('pkg/nix', 'k2', [link])
+    link.unlink()
+    link.symlink_to(target.parent)
+    assert proj.cache.get('pkg/nix', 'k2') is None
+
+
+def test_cache_update_from(proj, checksum_calls):
+    path = make_file(proj, 'pkgs/foo.deb')
+    proj.cache.update('pkg/debian-11', 'k1', [path])
+    del checksum_calls[:]
+    assert proj.cache.update_from(
+        'build/debian-11', 'p1', 'pkg/debian-11', 'k1')
+    assert not proj.cache.update_from(
+        'build/debian-11', 'p2', 'pkg/debian-11', 'nope')
+    assert proj.cache.get('build/debian-11', 'p1') == [path]
+    assert proj.cache.get('build/debian-11', 'p2') is None
+    assert checksum_calls == []
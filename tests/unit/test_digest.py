@@ -0,0 +1,105 @@
+import hashlib
+from pathlib import Path
+import os
+
+from apkg.util import digest
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+def test_digest_memoized(tmpdir, monkeypatch):
+    reads = []
+    orig_hash_file = digest.hash_file
+
+    def hash_file(path, **kwargs):
+        reads.append(path)
+        return orig_hash_file(path, **kwargs)
+
+    monkeypatch.setattr(digest, 'hash_file', hash_file)
+    # don't treat files just written by test as racy
+    monkeypatch.setattr(digest, 'RACY_NS', -1)
+    registry = digest.DigestRegistry()
+    path = Path(str(tmpdir)) / 'foo.tar.gz'
+    path.open('w').write('foo')
+    sha = hashlib.sha256(b'foo').hexdigest()
+    assert registry.digest(path) == sha
+    assert registry.digest(path) == sha
+    assert len(reads) == 1
+    b2 = hashlib.blake2b(b'foo').hexdigest()
+    assert registry.digest(path, algo=digest.INTERNAL_ALGO) == b2
+    assert registry.digest(path, memo=False) == sha
+    assert len(reads) == 3
+    path.open('w').write('foobar')
+    assert registry.digest(path) == hashlib.sha256(b'foobar').hexdigest()
+
+
+def test_digest_racy(tmpdir):
+    registry = digest.DigestRegistry()
+    path = Path(str(tmpdir)) / 'foo.tar.gz'
+    path.open('w').write('foo')
+    st = path.stat()
+    assert registry.digest(path) == hashlib.sha256(b'foo').hexdigest()
+    # modified within mtime resolution: same size and mtime
+    path.open('w').write('bar')
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert registry.digest(path) == hashlib.sha256(b'bar').hexdigest()
+    registry.register(path, 'bogus')
+    assert registry.digest(path) == hashlib.sha256(b'bar').hexdigest()
+    assert not registry.digests
+
+
+def test_digest_persisted(tmpdir):
+    path = Path(str(tmpdir)) / 'foo.tar.gz'
+    path.open('w').write('foo')
+    # recently modified files aren't persisted
+    os.utime(str(path), (1000000000, 1000000000))
+    cache_path = Path(str(tmpdir)) / 'digests.json'
+    registry = digest.DigestRegistry()
+    d = registry.digest(path)
+    registry.save(cache_path)
+    loaded = digest.DigestRegistry()
+    loaded.load(cache_path)
+    assert loaded.digests == registry.digests
+    assert loaded.digest(path) == d
+
+
+def test_file_digests_parallel(tmpdir):
+    paths = []
+    for i in range(20):
+        path = Path(str(tmpdir)) / ('%d.rpm' % i)
+        path.open('w').write('rpm%d' % i)
+        paths.append(path)
+    assert digest.file_digests(paths) == [
+        hashlib.sha256(('rpm%d' % i).encode()).hexdigest()
+        for i in range(20)]
+
+
+def test_copy_file_registers_digest(tmpdir, monkeypatch):
+    monkeypatch.setattr(digest, 'RACY_NS', -1)
+    src = Path(str(tmpdir)) / 'build' / 'foo.deb'
+    src.parent.mkdir()
+    src.open('w').write('deb')
+    dst = Path(str(tmpdir)) / 'out' / 'foo.deb'
+    d = digest.copy_file(src, dst)
+    assert dst.open().read() == 'deb'
+    assert d == hashlib.sha256(b'deb').hexdigest()
+    # copied file isn't read again
+    monkeypatch.setattr(digest, 'hash_file', None)
+    assert digest.file_digest(dst) == d
+
+
+def test_write_checksums_files(tmpdir):
+    out = Path(str(tmpdir)) / 'out'
+    out.mkdir()
+    paths = []
+    for name in ['foo.rpm', 'foo-devel.rpm']:
+        path = out / name
+        path.open('w').write(name)
+        paths.append(path)
+    assert digest.write_checksums_files(paths) == [out / 'SHA256SUMS']
+    assert (out / 'SHA256SUMS').open().read() == ''.join(
+        '%s  %s\n' % (hashlib.sha256(n.encode()).hexdigest(), n)
+        for n in ['foo-devel.rpm', 'foo.rpm'])
+    # up to date SHA256SUMS is kept
+    assert digest.write_checksums_files(paths) == []
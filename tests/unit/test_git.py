@@ -0,0 +1,196 @@
+from pathlib import Path
+import os
+
+import pytest
+
+from apkg.project import Project
+from apkg.util.git import commit_tree, find_git_dir, git, resolve_ref
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+@pytest.fixture
+def repo(tmpdir, monkeypatch):
+    path = Path(str(tmpdir)) / 'repo'
+    path.mkdir()
+    monkeypatch.chdir(str(path))
+    for var, val in [('GIT_AUTHOR_NAME', 'apkg'),
+                     ('GIT_AUTHOR_EMAIL', 'apkg@example.com'),
+                     ('GIT_COMMITTER_NAME', 'apkg'),
+                     ('GIT_COMMITTER_EMAIL', 'apkg@example.com')]:
+        monkeypatch.setenv(var, val)
+    git('init', '-q', '.')
+    (path / 'README').open('w').write('readme')
+    (path / '.gitignore').open('w').write('*.log\n')
+    git('add', '-A')
+    git('commit', '-q', '-m', 'init')
+    return path
+
+
+def checksum(path):
+    return Project(path=path).checksum
+
+
+def test_checksum_clean(repo):
+    assert checksum(repo) == git.current_commit()[:10]
+
+
+def test_checksum_worktree_changes(repo):
+    clean = checksum(repo)
+    # ignored files and apkg output don't affect checksum
+    (repo / 'build.log').open('w').write('log')
+    (repo / 'pkg').mkdir()
+    (repo / 'pkg' / 'foo.tar.gz').open('w').write('ar')
+    assert checksum(repo) == clean
+    # untracked file
+    (repo / 'new.c').open('w').write('new')
+    untracked = checksum(repo)
+    assert untracked.startswith(clean + '-')
+    # modified tracked file
+    (repo / 'README').open('w').write('changed')
+    modified = checksum(repo)
+    assert modified.startswith(clean + '-')
+    assert modified != untracked
+    # real index is left alone
+    assert git('status', '--porcelain').split('\n') == [
+        ' M README', '?? new.c', '?? pkg/']
+    os.unlink('new.c')
+    (repo / 'README').open('w').write('readme')
+    assert checksum(repo) == clean
+
+
+def test_checksum_archive_paths(repo):
+    config_path = repo / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True)
+    config_path.open('w').write(
+        '[project]\narchive_paths = ["src"]\narchive_export_ignore = true\n')
+    (repo / 'src').mkdir()
+    (repo / 'src' / 'main.c').open('w').write('main')
+    (repo / 'src' / 'test').mkdir()
+    (repo / 'src' / 'test' / 'test.c').open('w').write('test')
+    (repo / '.gitattributes').open('w').write('test export-ignore\n')
+    git('add', '-A')
+    git('commit', '-q', '-m', 'src')
+    scoped = checksum(repo)
+    assert scoped.startswith('tree-')
+    # unrelated changes don't affect checksum
+    (repo / 'README').open('w').write('docs')
+    git('commit', '-q', '-a', '-m', 'docs')
+    (repo / 'src' / 'test' / 'test.c').open('w').write('test2')
+    assert checksum(repo) == scoped
+    # archive paths and input dir do
+    (repo / 'src' / 'main.c').open('w').write('main2')
+    changed = checksum(repo)
+    assert changed != scoped
+    (repo / 'distro' / 'pkg').mkdir()
+    (repo / 'distro' / 'pkg' / 'PKGBUILD').open('w').write('pkg')
+    assert checksum(repo) != changed
+
+
+def test_resolve_ref(repo):
+    git_dir = find_git_dir(repo)
+    assert git_dir == str(repo / '.git')
+    head = git.current_commit()
+    assert resolve_ref(git_dir) == head
+    assert commit_tree(git_dir, head) == git('rev-parse', 'HEAD^{tree}')
+    # packed refs and objects
+    git('pack-refs', '--all')
+    git('gc', '-q')
+    branch = git.current_branch()
+    assert not (repo / '.git' / 'refs' / 'heads' / branch).exists()
+    assert resolve_ref(git_dir) == head
+    assert commit_tree(git_dir, head) is None
+    assert checksum(repo) == head[:10]
+
+
+def test_resolve_ref_worktree(repo):
+    git('worktree', 'add', '-q', '-b', 'wt', '../wt')
+    wt = repo.parent / 'wt'
+    (wt / 'sub').mkdir()
+    git_dir = find_git_dir(wt / 'sub')
+    assert git_dir == str(repo / '.git' / 'worktrees' / 'wt')
+    assert resolve_ref(git_dir) == git.current_commit()
+    assert find_git_dir(repo.parent) is None
+
+
+def test_checksum_no_commits(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    git('init', '-q', '.')
+    path = Path(str(tmpdir))
+    assert resolve_ref(find_git_dir(path)) is None
+    (path / 'README').open('w').write('readme')
+    assert checksum(path).startswith('tree-')
+
+
+def test_checksum_subdir_project(repo):
+    for proj in ['a', 'b']:
+        (repo / proj / 'distro' / 'pkg').mkdir(parents=True)
+        (repo / proj / 'main.c').open('w').write(proj)
+    git('add', '-A')
+    git('commit', '-q', '-m', 'projects')
+    a = checksum(repo / 'a')
+    assert a.startswith('tree-')
+    # changes in other projects don't affect checksum
+    (repo / 'b' / 'main.c').open('w').write('b2')
+    git('commit', '-q', '-a', '-m', 'b')
+    assert checksum(repo / 'a') == a
+    (repo / 'a' / 'main.c').open('w').write('a2')
+    assert checksum(repo / 'a') != a
+
+
+def test_checksum_output_ignored(repo):
+    (repo / '.gitignore').open('w').write('*.log\npkg/\n')
+    git('commit', '-q', '-a', '-m', 'ignore pkg')
+    clean = checksum(repo)
+    (repo / 'pkg').mkdir()
+    (repo / 'pkg' / 'foo.tar.gz').open('w').write('ar')
+    assert checksum(repo) == clean
+    assert checksum(repo) == clean
+
+
+def count_objects(repo):
+    return len(list((repo / '.git' / 'objects').glob('??/*')))
+
+
+def test_checksum_output_not_hashed(repo):
+    clean = checksum(repo)
+    (repo / 'pkg').mkdir()
+    (repo / 'pkg' / 'foo.tar.gz').open('w').write('ar')
+    objects = count_objects(repo)
+    # output files aren't written into git object store
+    assert checksum(repo) == clean
+    assert count_objects(repo) == objects
+
+
+def test_checksum_staged_and_modified(repo):
+    config_path = repo / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True)
+    config_path.open('w').write('[project]\narchive_paths = ["src"]\n')
+    (repo / 'src').mkdir()
+    (repo / 'src' / 'main.c').open('w').write('main')
+    (repo / 'docs').mkdir()
+    (repo / 'docs' / 'a').open('w').write('a')
+    git('add', '-A')
+    git('commit', '-q', '-m', 'src')
+    scoped = checksum(repo)
+    # staged and then modified again outside of archive paths
+    (repo / 'docs' / 'a').open('w').write('a2')
+    git('add', 'docs/a')
+    (repo / 'docs' / 'a').open('w').write('a3')
+    assert checksum(repo) == scoped
+    # staged and modified file in output dir
+    (repo / 'pkg').mkdir()
+    (repo / 'pkg' / 'foo').open('w').write('foo')
+    git('add', 'pkg/foo')
+    (repo / 'pkg' / 'foo').open('w').write('foo2')
+    assert checksum(repo) == scoped
+
+
+def test_checksum_staged_output(repo):
+    clean = checksum(repo)
+    (repo / 'pkg').mkdir()
+    (repo / 'pkg' / 'foo').open('w').write('foo')
+    git('add', 'pkg/foo')
+    (repo / 'pkg' / 'foo').open('w').write('foo2')
+    assert checksum(repo) == clean
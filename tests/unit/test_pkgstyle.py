@@ -0,0 +1,90 @@
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from apkg import ex
+from apkg import pkgstyle
+from apkg.project import Project
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+def test_pkgstyle_for_distro():
+    assert pkgstyle.get_pkgstyle_for_distro('Debian-11').name == 'deb'
+    assert pkgstyle.get_pkgstyle_for_distro('fedora-34').name == 'rpm'
+    assert pkgstyle.get_pkgstyle_for_distro('arch').name == 'arch'
+    assert pkgstyle.get_pkgstyle_for_distro('haiku') is None
+
+
+def test_import_pkgstyle_module():
+    # pkgstyle modules import apkg.pkgstyle which imports them back
+    for style in ['deb', 'rpm']:
+        subprocess.check_call(
+            [sys.executable, '-c', 'import apkg.pkgstyles.%s' % style])
+
+
+def test_distro_index():
+    index = pkgstyle.DistroIndex()
+    index.add('debian', 'generic')
+    index.add('debian-1', 'v1', versioned=True)
+    index.add('debian-11', 'v11', versioned=True)
+    assert index.resolve('debian-11') == 'v11'
+    assert index.resolve('debian-11.2') == 'v11'
+    assert index.resolve('debian-1') == 'v1'
+    assert index.resolve('debian-12') == 'generic'
+    assert index.resolve('ubuntu-20.04') is None
+
+
+def new_template(path, style):
+    path.mkdir(parents=True)
+    if style == 'deb':
+        for fn in ['rules', 'control', 'changelog']:
+            (path / fn).open('w').write('')
+    elif style == 'nix':
+        for fn in ['default.nix', 'top-level.nix']:
+            (path / fn).open('w').write('')
+    else:
+        (path / 'foo.spec').open('w').write('Name: foo\n')
+
+
+def test_template_for_distro(tmpdir):
+    proj = Project(path=Path(str(tmpdir)))
+    pkg_path = proj.templates_path
+    new_template(pkg_path / 'deb', 'deb')
+    new_template(pkg_path / 'debian-11', 'deb')
+    new_template(pkg_path / 'rpm', 'rpm')
+    assert proj.get_template_for_distro('debian-11').path.name == 'debian-11'
+    assert proj.get_template_for_distro('debian-10').path.name == 'deb'
+    assert proj.get_template_for_distro('Ubuntu-20.04').path.name == 'deb'
+    assert proj.get_template_for_distro('fedora-34').path.name == 'rpm'
+    with pytest.raises(ex.MissingPackagingTemplate):
+        proj.get_template_for_distro('arch')
+
+
+def test_template_for_distro_plain(tmpdir):
+    proj = Project(path=Path(str(tmpdir)))
+    pkg_path = proj.templates_path
+    # templates named after style or distro without version
+    new_template(pkg_path / 'nix', 'nix')
+    new_template(pkg_path / 'deb', 'deb')
+    new_template(pkg_path / 'ubuntu', 'deb')
+    assert proj.get_template_for_distro('nixos-23.05').path.name == 'nix'
+    assert proj.get_template_for_distro('nix').path.name == 'nix'
+    assert proj.get_template_for_distro('ubuntu-22.04').path.name == 'ubuntu'
+    assert proj.get_template_for_distro('debian-12').path.name == 'deb'
+
+
+def test_template_for_distro_fallback(tmpdir):
+    proj = Project(path=Path(str(tmpdir)))
+    pkg_path = proj.templates_path
+    # only distro templates, other distros of their style fall back to them
+    new_template(pkg_path / 'debian', 'deb')
+    new_template(pkg_path / 'debian-11', 'deb')
+    new_template(pkg_path / 'fedora', 'rpm')
+    assert proj.get_template_for_distro('debian-11').path.name == 'debian-11'
+    assert proj.get_template_for_distro('debian-12').path.name == 'debian'
+    assert proj.get_template_for_distro('ubuntu-22.04').path.name == 'debian'
+    assert proj.get_template_for_distro('centos-8').path.name == 'fedora'
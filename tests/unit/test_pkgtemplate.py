@@ -0,0 +1,75 @@
+from pathlib import Path
+
+from apkg import pkgtemplate
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+def test_render_include(tmpdir, monkeypatch):
+    base = Path(str(tmpdir))
+    cache_path = base / 'jinja-cache'
+    monkeypatch.setattr(pkgtemplate, '_JINJA_ENVS', {})
+    tpath = base / 'template'
+    tpath.mkdir()
+    (tpath / 'deps').open('w').write('Depends: {{ name }}-libs')
+    (tpath / 'control').open('w').write(
+        'Package: {{ name }}\n{% include "deps" %}')
+    t = pkgtemplate.PackageTemplate(tpath, jinja_cache_path=cache_path)
+    env = {'name': 'foo'}
+    assert t.render_file_content('control', env) == \
+        'Package: foo\nDepends: foo-libs\n'
+    assert list(cache_path.iterdir())
+    # environment is shared
+    t2 = pkgtemplate.PackageTemplate(tpath, jinja_cache_path=cache_path)
+    assert t2.jinja_env is t.jinja_env
+    out = base / 'out'
+    t2.render(out, env)
+    assert (out / 'control').open().read() == \
+        'Package: foo\nDepends: foo-libs\n'
+    # but not between different bytecode cache dirs
+    cache_path2 = base / 'jinja-cache2'
+    t3 = pkgtemplate.PackageTemplate(tpath, jinja_cache_path=cache_path2)
+    assert t3.jinja_env is not t.jinja_env
+    t3.render_file_content('control', env)
+    assert list(cache_path2.iterdir())
+    assert pkgtemplate.PackageTemplate(tpath).jinja_env.bytecode_cache is None
+
+
+def test_render_incremental(tmpdir):
+    base = Path(str(tmpdir))
+    tpath = base / 'template'
+    tpath.mkdir()
+    (tpath / 'control').open('w').write('Version: {{ version }}')
+    (tpath / 'fix.patch').open('w').write('patch')
+    (tpath / 'rules').open('w').write('rules')
+    (tpath / 'rules').chmod(0o755)
+    t = pkgtemplate.PackageTemplate(tpath)
+    out = base / 'out'
+    assert t.render(out, {'version': '1'}) == (3, 0, 0)
+    assert (out / 'rules').stat().st_mode & 0o777 == 0o755
+    mtimes = {p.name: p.stat().st_mtime_ns for p in out.iterdir()}
+    # nothing changed
+    assert t.render(out, {'version': '1'}) == (0, 3, 0)
+    assert {p.name: p.stat().st_mtime_ns for p in out.iterdir()} == mtimes
+    # only changed file is written, stale files are pruned
+    (out / 'stale').open('w').write('stale')
+    assert t.render(out, {'version': '2'}, prune=True) == (1, 2, 1)
+    assert (out / 'control').open().read() == 'Version: 2\n'
+    assert (out / 'fix.patch').stat().st_mtime_ns == mtimes['fix.patch']
+    assert not (out / 'stale').exists()
+
+
+def test_build_deps_bytecode_cache(tmpdir, monkeypatch):
+    base = Path(str(tmpdir))
+    cache_path = base / 'jinja-cache'
+    monkeypatch.setattr(pkgtemplate, '_JINJA_ENVS', {})
+    tpath = base / 'deb'
+    tpath.mkdir()
+    (tpath / 'control').open('w').write(
+        'Source: {{ name }}\nBuild-Depends: debhelper, {{ name }}-dev\n')
+    deb = pkgtemplate._pkgstyle.PKGSTYLES['deb']
+    deps = deb.get_build_deps_from_template(
+        tpath, distro='debian-12', jinja_cache_path=cache_path)
+    assert deps == ['debhelper', 'PKGNAME-dev']
+    assert list(cache_path.iterdir())
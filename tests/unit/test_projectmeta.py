@@ -0,0 +1,61 @@
+from pathlib import Path
+import os
+
+import pytest
+
+from apkg import pkgtemplate
+from apkg.project import Project
+import apkg.project
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+def set_old_mtime(path, mtime=1600000000):
+    os.utime(str(path), (mtime, mtime))
+
+
+@pytest.fixture
+def proj_path(tmpdir):
+    path = Path(str(tmpdir))
+    config_path = path / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True)
+    config_path.open('w').write('[project]\nname = "foo"\n')
+    tpath = path / 'distro' / 'pkg' / 'deb'
+    tpath.mkdir(parents=True)
+    (tpath / 'control').open('w').write('Source: foo\n')
+    for fn in ['rules', 'changelog']:
+        (tpath / fn).open('w').write('')
+    for p in [config_path, *tpath.iterdir(), tpath, tpath.parent]:
+        set_old_mtime(p)
+    return path
+
+
+def no_discovery(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected project metadata discovery")
+    monkeypatch.setattr(apkg.project.toml, 'load', fail)
+    monkeypatch.setattr(
+        pkgtemplate._pkgstyle, 'get_pkgstyle_for_template', fail)
+    monkeypatch.setattr(
+        pkgtemplate._pkgstyle.PKGSTYLES['deb'], 'get_template_name', fail)
+
+
+def test_project_meta(proj_path, monkeypatch):
+    proj = Project(path=proj_path)
+    assert proj.name == 'foo'
+    assert proj.templates[0].name == 'foo'
+    assert proj.meta_path.exists()
+    # warm load uses snapshot only
+    with monkeypatch.context() as m:
+        no_discovery(m)
+        proj = Project(path=proj_path)
+        assert proj.name == 'foo'
+        template = proj.templates[0]
+        assert template.pkgstyle.name == 'deb'
+        assert template.name == 'foo'
+    # modified template is discovered again
+    control = proj_path / 'distro' / 'pkg' / 'deb' / 'control'
+    control.open('w').write('Source: bar\n')
+    set_old_mtime(control, 1600000001)
+    assert Project(path=proj_path).templates[0].name == 'bar'
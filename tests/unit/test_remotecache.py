@@ -0,0 +1,151 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+import json
+import threading
+
+import pytest
+
+from apkg.cache import file_checksum
+from apkg.project import Project
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    minimal in-memory HTTP GET/HEAD/PUT server to stand in for remote cache
+    """
+    files = {}
+
+    def do_HEAD(self):
+        self.send_response(200 if self.path in self.files else 404)
+        self.end_headers()
+
+    def do_GET(self):
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        length = int(self.headers['Content-Length'])
+        self.files[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def http_remote():
+    StandInHandler.files = {}
+    server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d/cache' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dir_remote(tmpdir):
+    return str(Path(str(tmpdir)) / 'remote')
+
+
+@pytest.fixture(params=['dir', 'http'])
+def remote(request):
+    return request.getfixturevalue('%s_remote' % request.param)
+
+
+def new_project(path, remote, store=None):
+    config_path = path / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+    config = '[project]\nname = "foo"\n[cache]\nremote = "%s"\n' % remote
+    if store is not None:
+        config += 'store = %s\n' % str(store).lower()
+    config_path.open('w').write(config)
+    return Project(path=path)
+
+
+def test_remote_cache_pull(tmpdir, remote):
+    base = Path(str(tmpdir))
+    # runner 1 builds and pushes
+    proj1 = new_project(base / 'runner1', remote)
+    ar = proj1.dev_archive_path / 'foo-1.0.tar.gz'
+    ar.parent.mkdir(parents=True)
+    ar.open('w').write('archive')
+    proj1.cache.update('archive/dev', 'abc123', [ar])
+    # runner 2 has empty local cache and pulls ready artifact
+    proj2 = new_project(base / 'runner2', remote)
+    paths = proj2.cache.get('archive/dev', 'abc123')
+    ar2 = proj2.dev_archive_path / 'foo-1.0.tar.gz'
+    assert paths == [ar2]
+    assert ar2.open().read() == 'archive'
+    # pulled entry is cached locally
+    proj2.cache.flush()
+    assert Project(path=proj2.path).cache.get(
+        'archive/dev', 'abc123') == [ar2]
+
+
+def test_remote_cache_miss(tmpdir, remote):
+    proj = new_project(Path(str(tmpdir)) / 'runner', remote)
+    assert proj.cache.get('archive/dev', 'abc123') is None
+
+
+def test_remote_cache_unavailable(tmpdir):
+    proj = new_project(Path(str(tmpdir)) / 'runner', 'http://127.0.0.1:1')
+    assert proj.cache.get('archive/dev', 'abc123') is None
+
+
+def test_remote_cache_outside_of_project(tmpdir, dir_remote):
+    base = Path(str(tmpdir))
+    proj = new_project(base / 'runner', dir_remote)
+    evil = base / 'evil.txt'
+    evil.open('w').write('evil')
+    checksum = file_checksum(evil)
+    manifest = {'files': [['../outside.txt', checksum]]}
+    remote = proj.cache.remote.remote
+    remote.put_bytes(proj.cache.remote.manifest_name('archive/dev', 'abc123'),
+                     json.dumps(manifest).encode('utf-8'))
+    remote.put_file('objects/%s' % checksum, evil)
+    assert proj.cache.get('archive/dev', 'abc123') is None
+    assert not (base / 'outside.txt').exists()
+
+
+def test_remote_cache_invalid_object(tmpdir, dir_remote):
+    base = Path(str(tmpdir))
+    proj = new_project(base / 'runner', dir_remote)
+    ar = proj.dev_archive_path / 'foo-1.0.tar.gz'
+    ar.parent.mkdir(parents=True)
+    ar.open('w').write('archive')
+    proj.cache.update('archive/dev', 'abc123', [ar])
+    checksum = file_checksum(ar)
+    # corrupted remote object doesn't replace local file
+    (Path(dir_remote) / 'objects' / checksum).open('w').write('bad')
+    ar.open('w').write('local')
+    assert proj.cache.remote.pull('archive/dev', 'abc123') is None
+    assert ar.open().read() == 'local'
+    assert [p.name for p in ar.parent.iterdir()] == [ar.name]
+
+
+def test_remote_cache_pull_from_store(tmpdir, dir_remote):
+    proj = new_project(Path(str(tmpdir)) / 'runner', dir_remote, store=True)
+    ar = proj.dev_archive_path / 'foo-1.0.tar.gz'
+    ar.parent.mkdir(parents=True)
+    ar.open('w').write('archive')
+    proj.cache.update('archive/dev', 'abc123', [ar])
+    proj.cache.delete('archive/dev', 'abc123')
+    ar.unlink()
+    # file is restored from local store without downloading
+    for obj in (Path(dir_remote) / 'objects').iterdir():
+        obj.unlink()
+    assert proj.cache.get('archive/dev', 'abc123') == [ar]
+    assert ar.open().read() == 'archive'
@@ -0,0 +1,59 @@
+from pathlib import Path
+import os
+
+from apkg.util.treehash import tree_hash, TreeHasher
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+def make_tree(path):
+    (path / 'src').mkdir(parents=True)
+    (path / 'src' / 'main.c').open('w').write('int main;')
+    (path / 'README').open('w').write('readme')
+    (path / 'build').mkdir()
+    (path / 'build' / 'main.o').open('w').write('obj')
+    (path / '.gitignore').open('w').write('/build/\n*.log\n!keep.log\n')
+    return path
+
+
+def test_tree_hash_content(tmpdir):
+    path = make_tree(Path(str(tmpdir)) / 'proj')
+    h = tree_hash(path)
+    assert tree_hash(path) == h
+    (path / 'src' / 'main.c').open('w').write('int main();')
+    assert tree_hash(path) != h
+
+
+def test_tree_hash_ignored(tmpdir):
+    path = make_tree(Path(str(tmpdir)) / 'proj')
+    h = tree_hash(path, exclude=[path / 'pkg'])
+    (path / 'build' / 'main.o').open('w').write('obj2')
+    (path / 'src' / 'debug.log').open('w').write('log')
+    (path / 'pkg').mkdir()
+    (path / 'pkg' / 'foo.tar.gz').open('w').write('ar')
+    assert tree_hash(path, exclude=[path / 'pkg']) == h
+    # negated pattern
+    (path / 'keep.log').open('w').write('log')
+    assert tree_hash(path, exclude=[path / 'pkg']) != h
+
+
+def test_tree_hash_memo(tmpdir):
+    path = make_tree(Path(str(tmpdir)) / 'proj')
+    # recently modified files aren't memoized
+    for f in path.glob('**/*'):
+        os.utime(str(f), (1000000000, 1000000000))
+    hasher = TreeHasher(path, memo_path=Path(str(tmpdir)) / 'memo.json')
+    h = hasher.hash()
+    assert hasher.hashed == 3
+    assert hasher.hash() == h
+    assert hasher.hashed == 0
+
+
+def test_tree_hash_include(tmpdir):
+    path = make_tree(Path(str(tmpdir)) / 'proj')
+    h = tree_hash(path, include=['src'])
+    (path / 'README').open('w').write('changed')
+    assert tree_hash(path, include=['src']) == h
+    (path / 'src' / 'main.c').open('w').write('changed')
+    assert tree_hash(path, include=['src']) != h
@@ -0,0 +1,73 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+import threading
+
+from packaging import version
+import pytest
+
+from apkg.util.upstreamversion import VersionCache, version_from_listing
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+LISTING = b'''<html><body>
+<a href="foo-1.0.tar.xz">foo-1.0.tar.xz</a>
+<a href="foo-1.2.tar.xz">foo-1.2.tar.xz</a>
+</body></html>'''
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    """
+    HTML listing supporting ETag revalidation which counts requests
+    """
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        inm = self.headers.get('If-None-Match')
+        self.requests.append(inm)
+        if inm == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(LISTING)))
+        self.end_headers()
+        self.wfile.write(LISTING)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def listing_url():
+    ListingHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), ListingHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d/foo/' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def test_version_cache(tmpdir, listing_url):
+    path = Path(str(tmpdir)) / 'versions.json'
+    v = version.parse('1.2')
+    assert version_from_listing(
+        listing_url, cache=VersionCache(path)) == v
+    assert ListingHandler.requests == [None]
+    # fresh cached version doesn't query upstream, even across processes
+    assert version_from_listing(
+        listing_url, cache=VersionCache(path)) == v
+    assert len(ListingHandler.requests) == 1
+    # stale version is revalidated
+    assert version_from_listing(
+        listing_url, cache=VersionCache(path, ttl=0)) == v
+    assert ListingHandler.requests[1:] == ['"v1"']
+    # refresh ignores cache
+    assert version_from_listing(
+        listing_url, cache=VersionCache(path), refresh=True) == v
+    assert ListingHandler.requests[2:] == [None]
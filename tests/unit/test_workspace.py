@@ -0,0 +1,60 @@
+from pathlib import Path
+import os
+
+from apkg import cache as _cache
+from apkg import ex
+from apkg import workspace
+
+
+# NOTE(py35): use tmp_path instead of tmpdir
+#             when py3.5 support is dropped
+
+def new_workspace(path):
+    for proj in ['a', 'libs/b', 'libs/b/bindings/c']:
+        (path / proj / 'distro' / 'pkg' / 'deb').mkdir(parents=True)
+    config_path = path / 'd' / 'distro' / 'config' / 'apkg.toml'
+    config_path.parent.mkdir(parents=True)
+    config_path.open('w').write('[project]\nname = "d"\n')
+    # not projects
+    (path / 'e' / 'distro').mkdir(parents=True)
+    (path / '.hidden' / 'distro' / 'pkg').mkdir(parents=True)
+    (path / 'a' / 'pkg' / 'x' / 'distro' / 'pkg').mkdir(parents=True)
+    return path
+
+
+def test_discover_projects(tmpdir):
+    path = new_workspace(Path(str(tmpdir)))
+    assert workspace.discover_projects(path) == [
+        path / p for p in ['a', 'd', 'libs/b', 'libs/b/bindings/c']]
+
+
+def fake_command(fail=False):
+    if fail and Path('.').resolve().name == 'd':
+        raise ex.InvalidInput(fail="d is broken")
+    if fail and Path('.').resolve().name == 'c':
+        raise RuntimeError("c crashed")
+    out = Path('pkg') / 'out'
+    out.parent.mkdir(exist_ok=True)
+    out.open('w').write(os.environ[_cache.STORE_ENV_VAR])
+    return [out]
+
+
+def test_run_workspace_command(tmpdir, monkeypatch):
+    path = new_workspace(Path(str(tmpdir)))
+    monkeypatch.setitem(workspace.WORKSPACE_COMMANDS, 'fake', fake_command)
+    results = workspace.run_workspace_command(
+        path, 'fake', jobs=2, fail=True)
+    store = str(path / 'pkg' / '.store')
+    assert len(results) == 4
+    for project_path, paths, error in results:
+        if project_path.name == 'd':
+            assert paths == []
+            assert 'd is broken' in error
+            continue
+        if project_path.name == 'c':
+            assert paths == []
+            assert 'RuntimeError: c crashed' in error
+            continue
+        assert error is None
+        assert paths == [str(project_path / 'pkg' / 'out')]
+        assert Path(paths[0]).open().read() == store